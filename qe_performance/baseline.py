@@ -0,0 +1,104 @@
+"""
+What does encryption cost? This runs the same insert and query workload
+against ENCRYPTED_COLLECTION (through the auto-encrypting client) and against
+a plaintext twin, PLAINTEXT_COLLECTION (through a plain client), and reports
+the encrypted/plaintext ratio for throughput, latency and storage.
+
+The two are interleaved batch by batch and query by query, swapping which one
+goes first each time, so that drift in the cluster or the network hits both
+sides equally.
+
+The plaintext twin gets an ordinary index on encrypted_string, since the
+encrypted side effectively has one in __safeContent__. Set PLAINTEXT_INDEX to
+False to compare against a collection scan instead.
+"""
+
+from latency import LatencyHistogram, now_ns, PERCENTILES
+from sweeps import encrypted_and_plaintext, generate_workload
+from utils import create_client, create_plain_client, storage_stats, state_collection_names, ENCRYPTED_COLLECTION, PLAINTEXT_COLLECTION, write_line_to_csv
+
+ITEMS_TO_CREATE = 200  # per insert_many
+INSERT_BATCHES = 500
+QUERIES = 10000
+VALUE_CARDINALITY = 200  # distinct encrypted_string values
+QUERY_DISTRIBUTION = "uniform"  # see distributions.py
+PLAINTEXT_INDEX = True
+SEED = 0
+
+
+def run_interleaved(operation, encrypted_target, plaintext_target, histograms, flip):
+    # runs the operation on both sides, swapping the order every other call
+    sides = [("encrypted", encrypted_target), ("plaintext", plaintext_target)]
+    if flip:
+        sides.reverse()
+    for side, target in sides:
+        start_time = now_ns()
+        operation(target)
+        histograms[side].record_since(start_time)
+
+
+def insert_workload(encrypted_collection, plaintext_collection, batches):
+    histograms = { "encrypted": LatencyHistogram(), "plaintext": LatencyHistogram() }
+    for batch_number, batch in enumerate(batches):
+        print(f"Inserting batch {batch_number + 1} of {INSERT_BATCHES} on both sides...")
+        # insert_many adds an _id to each document, so each side gets a copy
+        run_interleaved(lambda collection: collection.insert_many([dict(document) for document in batch]),
+            encrypted_collection, plaintext_collection, histograms, batch_number % 2 == 1)
+    return histograms
+
+
+def query_workload(encrypted_collection, plaintext_collection, filters):
+    histograms = { "encrypted": LatencyHistogram(), "plaintext": LatencyHistogram() }
+    for query_number, filter in enumerate(filters):
+        run_interleaved(lambda collection: list(collection.find(filter)),
+            encrypted_collection, plaintext_collection, histograms, query_number % 2 == 1)
+    return histograms
+
+
+def report_row(metric, encrypted, plaintext):
+    ratio = encrypted / plaintext if plaintext else float("inf")
+    print(f"{metric:>31} {encrypted:>14.3f} {plaintext:>14.3f} {ratio:>8.2f}x")
+    # metric, encrypted, plaintext, encrypted / plaintext
+    write_line_to_csv("baseline_output.csv", [metric, encrypted, plaintext, ratio])
+
+
+def report_latency(operation, histograms, per_operation):
+    encrypted = histograms["encrypted"]
+    plaintext = histograms["plaintext"]
+    report_row(f"{operation}/s", per_operation * 1e9 / (encrypted.mean() or 1),
+        per_operation * 1e9 / (plaintext.mean() or 1))
+    encrypted_summary = encrypted.summary_ms()
+    plaintext_summary = plaintext.summary_ms()
+    for percent in PERCENTILES:
+        report_row(f"{operation} p{percent} (ms)", encrypted_summary[f"p{percent}"], plaintext_summary[f"p{percent}"])
+    report_row(f"{operation} max (ms)", encrypted_summary["max"], plaintext_summary["max"])
+
+
+if __name__ == "__main__":
+    mongo_client = create_client()
+    plain_client = create_plain_client()
+
+    batches, filters = generate_workload(ITEMS_TO_CREATE, INSERT_BATCHES, QUERIES, VALUE_CARDINALITY,
+        QUERY_DISTRIBUTION, SEED)
+
+    with encrypted_and_plaintext(mongo_client, plain_client, PLAINTEXT_INDEX) as (encrypted_collection, plaintext_collection):
+        inserts = insert_workload(encrypted_collection, plaintext_collection, batches)
+        queries = query_workload(encrypted_collection, plaintext_collection, filters)
+
+        encrypted_storage = storage_stats(plain_client, ENCRYPTED_COLLECTION)
+        state_storage = [storage_stats(plain_client, name) for name in state_collection_names(ENCRYPTED_COLLECTION)]
+        plaintext_storage = storage_stats(plain_client, PLAINTEXT_COLLECTION)
+
+    print(f"{'':>31} {'encrypted':>14} {'plaintext':>14} {'ratio':>9}")
+    report_latency("docs inserted", inserts, ITEMS_TO_CREATE)
+    report_latency("queries", queries, 1)
+    for stat in ["size", "storageSize", "totalIndexSize"]:
+        encrypted = encrypted_storage[stat] + sum(state[stat] for state in state_storage)
+        report_row(f"{stat} (MB, with state)", encrypted / 2**20, plaintext_storage[stat] / 2**20)
+
+    for side in ["encrypted", "plaintext"]:
+        inserts[side].save(f"baseline_{side}_inserts.json")
+        queries[side].save(f"baseline_{side}_queries.json")
+
+    plain_client.close()
+    mongo_client.close()
@@ -0,0 +1,74 @@
+"""
+Which batch size gets encrypted documents in fastest? writer.py always does
+an ordered insert_many of 200, which is one point out of many.
+
+For every combination of BATCH_SIZES, ORDERED and METHODS this creates a fresh
+encrypted collection, inserts DOCUMENTS documents in batches of that size and
+prints a table of docs/s and per-batch latency (also written to
+batch_sweep_output.csv). Every encrypted insert also writes to the ESC and
+ECOC state collections, so the table shows how many state documents each
+point left behind.
+
+  * insert_many - collection.insert_many(batch, ordered=...)
+  * bulk_write  - collection.bulk_write([InsertOne(...), ...], ordered=...)
+"""
+
+import itertools
+from pymongo import InsertOne
+from docgen import DocumentGenerator
+from distributions import create_distribution
+from sweeps import recreate_encrypted_collection, timed_inserts, total_storage, print_table, write_table_csv
+from utils import create_client, create_plain_client, DB_NAME, ENCRYPTED_FIELDS_MAP
+
+BATCH_SIZES = [1, 10, 100, 200, 1000, 10000]
+ORDERED = [True, False]
+METHODS = ["insert_many", "bulk_write"]
+DOCUMENTS = 20000  # per point
+VALUE_CARDINALITY = 200
+SEED = 0
+
+COLUMNS = ["batch size", "ordered", "method", "docs/s", "batch p50 ms", "batch p99 ms",
+           "p99 ms/doc", "state docs"]
+
+
+def generate_batches(batch_size, method):
+    generator = DocumentGenerator(seed=SEED,
+        value_distribution=create_distribution("uniform", VALUE_CARDINALITY))
+    for batch in generator.batches(batch_size, DOCUMENTS):
+        yield batch if method == "insert_many" else [InsertOne(document) for document in batch]
+
+
+def run_point(mongo_client, plain_client, number, batch_size, ordered, method):
+    collection_name = f"batch_{number}"
+    print(f"Batch point {number}: {method} of {batch_size}, {'ordered' if ordered else 'unordered'}...")
+    collection = recreate_encrypted_collection(mongo_client, collection_name, ENCRYPTED_FIELDS_MAP)
+
+    insert = getattr(collection, method)
+    inserts, docs_per_second = timed_inserts(collection, generate_batches(batch_size, method),
+        lambda batch: insert(batch, ordered=ordered))
+
+    storage = total_storage(plain_client, collection_name)
+    mongo_client[DB_NAME].drop_collection(collection_name)
+
+    summary = inserts.summary_ms()
+    inserts.save(f"batch_{batch_size}_{'ordered' if ordered else 'unordered'}_{method}.json")
+    return [batch_size, ordered, method, docs_per_second, summary["p50"], summary["p99"],
+        summary["p99"] / batch_size, storage["stateCount"]]
+
+
+if __name__ == "__main__":
+    mongo_client = create_client()
+    plain_client = create_plain_client()
+
+    rows = [
+        run_point(mongo_client, plain_client, number, batch_size, ordered, method)
+        for number, (batch_size, ordered, method)
+        in enumerate(itertools.product(BATCH_SIZES, ORDERED, METHODS))
+    ]
+
+    print()
+    print_table(COLUMNS, rows)
+    write_table_csv("batch_sweep_output.csv", COLUMNS, rows)
+
+    plain_client.close()
+    mongo_client.close()
@@ -0,0 +1,99 @@
+"""
+How much of an encrypted insert or find is the client? This runs the writer's
+inserts and the reader's finds against a local deployment, encrypted and
+plaintext, and splits each operation's wall time into the server round trips
+(from command monitoring) and everything else, which is the client: BSON
+encoding, query analysis, encryption, decryption and decoding.
+
+    QE_PERFORMANCE_URI=mongodb://127.0.0.1:27017/ python client_overhead.py
+
+Any mongod that supports QE will do (a single-node replica set on a laptop or
+a CI box). It refuses to run against Atlas, where the network would be most of
+what it measured.
+
+CPU time per operation comes from resources.py. Set PROFILE to also run each
+encrypted workload under cProfile; the stats go to client_overhead_<op>.prof
+and the top PROFILE_LINES functions are printed.
+"""
+
+import cProfile
+import pstats
+from latency import now_ns
+from phases import CommandTimer
+from resources import ResourceSampler
+from sweeps import encrypted_and_plaintext, generate_workload, print_table, write_table_csv
+from utils import create_client, create_plain_client, USE_ATLAS
+
+ITEMS_TO_CREATE = 200  # per insert_many, like writer.py
+INSERT_BATCHES = 500
+QUERIES = 10000
+VALUE_CARDINALITY = 200
+SAMPLE_SECONDS = 1
+PROFILE = False
+PROFILE_LINES = 25
+SEED = 0
+
+COLUMNS = ["side", "operation", "ops", "wall us/op", "server us/op", "client us/op", "CPU us/op"]
+
+
+def measure(side, operation, timer, workload, operations):
+    sampler = ResourceSampler(f"client_overhead_{side}_{operation}_samples.csv", SAMPLE_SECONDS)
+    profiler = cProfile.Profile() if PROFILE and side == "encrypted" else None
+
+    timer.take()
+    start_time = now_ns()
+    if profiler is not None:
+        profiler.enable()
+    workload()
+    if profiler is not None:
+        profiler.disable()
+    wall = now_ns() - start_time
+    server = sum(timer.take().values())
+
+    sampler.operations.add(operations)
+    resources = sampler.stop()
+    if profiler is not None:
+        profiler.dump_stats(f"client_overhead_{operation}.prof")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(PROFILE_LINES)
+
+    return [side, operation, operations, wall / 1000 / operations, server / 1000 / operations,
+        (wall - server) / 1000 / operations, resources["cpu_us_per_op"]]
+
+
+def measure_side(side, collection, timer):
+    batches, filters = generate_workload(ITEMS_TO_CREATE, INSERT_BATCHES, QUERIES, VALUE_CARDINALITY, seed=SEED)
+
+    def inserts():
+        for batch in batches:
+            collection.insert_many(batch)
+
+    def queries():
+        for filter in filters:
+            for result in collection.find(filter):
+                pass
+
+    print(f"Measuring {side} inserts and queries...")
+    return [
+        measure(side, "insert", timer, inserts, ITEMS_TO_CREATE * INSERT_BATCHES),
+        measure(side, "query", timer, queries, QUERIES),
+    ]
+
+
+if __name__ == "__main__":
+    if USE_ATLAS:
+        raise Exception("Set QE_PERFORMANCE_URI to a local deployment, see the top of this file.")
+
+    timer = CommandTimer()
+    mongo_client = create_client(event_listeners=[timer])
+    plain_client = create_plain_client(event_listeners=[timer])
+
+    with encrypted_and_plaintext(mongo_client, plain_client) as (encrypted_collection, plaintext_collection):
+        rows = measure_side("encrypted", encrypted_collection, timer)
+        rows += measure_side("plaintext", plaintext_collection, timer)
+
+    print()
+    print_table(COLUMNS, rows)
+    write_table_csv("client_overhead_output.csv", COLUMNS, rows)
+
+    plain_client.close()
+    mongo_client.close()
@@ -0,0 +1,125 @@
+"""
+Watches the QE state collections (enxcol_.<collection>.esc and .ecoc) grow
+during a long insert run, compacts them at set points and shows what
+compaction costs and what it buys.
+
+    python compaction.py
+
+After each count of batches in COMPACT_AT_BATCHES we run PROBE_QUERIES finds, time a
+compactStructuredEncryptionData, and run the same finds again. Meanwhile a
+StateSampler thread writes the size of the state collections to
+compaction_state_samples.csv every SAMPLE_SECONDS, so you can plot growth and
+the drops at each compaction.
+
+StateSampler can also be used on its own next to any other run (writer.py
+does when SAMPLE_STATE_SECONDS is set).
+"""
+
+import threading
+import time
+from docgen import DocumentGenerator
+from distributions import create_distribution
+from latency import now_ns, NANOSECONDS_PER_MILLISECOND
+from sweeps import recreate_encrypted_collection, timed_finds
+from utils import create_client, create_plain_client, storage_stats, state_collection_names, DB_NAME, ENCRYPTED_FIELDS_MAP, write_line_to_csv
+
+COLLECTION = "compaction_collection"
+ITEMS_TO_CREATE = 200  # per insert_many
+INSERT_BATCHES = 5000
+COMPACT_AT_BATCHES = [1000, 2000, 3000, 4000, 5000]  # compact after these many batches
+PROBE_QUERIES = 200
+VALUE_CARDINALITY = 200
+SAMPLE_SECONDS = 10
+SEED = 0
+
+
+class StateSampler:
+    """
+    A background thread that samples the state collections of an encrypted
+    collection every interval seconds and appends them to a CSV.
+    """
+
+    def __init__(self, plain_client, collection_name, filename, interval):
+        self.plain_client = plain_client
+        self.collection_name = collection_name
+        self.filename = filename
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.start_time = time.time()
+        self.thread = threading.Thread(target=self._sample_loop, daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        elapsed = time.time() - self.start_time
+        for name in state_collection_names(self.collection_name):
+            stats = storage_stats(self.plain_client, name)
+            # elapsed (s), state collection, documents, size, storage size, index size (bytes)
+            write_line_to_csv(self.filename, [elapsed, name, stats["count"], stats["size"],
+                stats["storageSize"], stats["totalIndexSize"]])
+
+    def _sample_loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.sample()  # one last look
+
+
+def compact(mongo_client, collection_name, db_name=DB_NAME):
+    """
+    Compacts the state collections and returns how long it took in ms. Needs
+    the auto-encrypting client, which adds the compaction tokens.
+    """
+
+    start_time = now_ns()
+    mongo_client[db_name].command("compactStructuredEncryptionData", collection_name)
+    return (now_ns() - start_time) / NANOSECONDS_PER_MILLISECOND
+
+
+def probe_queries(collection):
+    query_values = create_distribution("uniform", VALUE_CARDINALITY)
+    return timed_finds(collection,
+        ({ "encrypted_string": f"{query_values.next()}" } for i in range(PROBE_QUERIES)))
+
+
+def state_document_count(plain_client, collection_name):
+    return sum(storage_stats(plain_client, name)["count"] for name in state_collection_names(collection_name))
+
+
+def compact_and_compare(mongo_client, plain_client, collection, batches_done):
+    before = probe_queries(collection).summary_ms()
+    state_before = state_document_count(plain_client, COLLECTION)
+    compaction_ms = compact(mongo_client, COLLECTION)
+    state_after = state_document_count(plain_client, COLLECTION)
+    after = probe_queries(collection).summary_ms()
+
+    print(f"After {batches_done} batches: compaction took {compaction_ms:.1f} ms, "
+          f"state documents {state_before} -> {state_after}, "
+          f"find p50 {before['p50']:.2f} -> {after['p50']:.2f} ms, "
+          f"p99 {before['p99']:.2f} -> {after['p99']:.2f} ms")
+    # batches, compaction (ms), state docs before, state docs after,
+    # find p50 before, find p99 before, find p50 after, find p99 after (ms)
+    write_line_to_csv("compaction_output.csv", [batches_done, compaction_ms, state_before,
+        state_after, before["p50"], before["p99"], after["p50"], after["p99"]])
+
+
+if __name__ == "__main__":
+    mongo_client = create_client()
+    plain_client = create_plain_client()
+
+    collection = recreate_encrypted_collection(mongo_client, COLLECTION, ENCRYPTED_FIELDS_MAP)
+    sampler = StateSampler(plain_client, COLLECTION, "compaction_state_samples.csv", SAMPLE_SECONDS)
+
+    generator = DocumentGenerator(seed=SEED,
+        value_distribution=create_distribution("uniform", VALUE_CARDINALITY))
+    for batch_number, batch in enumerate(generator.batches(ITEMS_TO_CREATE, ITEMS_TO_CREATE * INSERT_BATCHES)):
+        collection.insert_many(batch)
+        if batch_number + 1 in COMPACT_AT_BATCHES:
+            compact_and_compare(mongo_client, plain_client, collection, batch_number + 1)
+
+    sampler.stop()
+    mongo_client[DB_NAME].drop_collection(COLLECTION)
+    plain_client.close()
+    mongo_client.close()
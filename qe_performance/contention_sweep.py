@@ -0,0 +1,105 @@
+"""
+How does the contention factor on encrypted_string trade insert throughput
+against find latency for our cardinalities?
+
+For each value in CONTENTION_FACTORS this creates a fresh encrypted collection
+with that contention, inserts the same documents, runs the same finds and
+then prints a table comparing them (also written to
+contention_sweep_output.csv).
+
+Higher contention spreads inserts of a hot value over more ESC entries, so
+concurrent inserts collide less, but every find has to ask for all of them.
+Set INSERT_THREADS above 1 to see the insert side of that.
+"""
+
+import copy
+import threading
+from docgen import DocumentGenerator
+from distributions import create_distribution
+from latency import LatencyHistogram, now_ns
+from sweeps import recreate_encrypted_collection, timed_inserts, timed_finds, total_storage, print_table, write_table_csv
+from utils import create_client, create_plain_client, DB_NAME, ENCRYPTED_FIELDS_MAP
+
+CONTENTION_FACTORS = [0, 1, 2, 4, 8, 16]
+ITEMS_TO_CREATE = 200  # per insert_many
+INSERT_BATCHES = 200
+INSERT_THREADS = 1
+QUERIES = 2000
+VALUE_CARDINALITY = 200
+VALUE_DISTRIBUTION = "uniform"  # see distributions.py, try "zipfian" for hot values
+SEED = 0
+
+COLUMNS = ["contention", "docs/s", "insert p50 ms", "insert p99 ms",
+           "find p50 ms", "find p99 ms", "state docs", "state MB", "MB"]
+
+
+def encrypted_fields_with_contention(contention):
+    encrypted_fields = copy.deepcopy(ENCRYPTED_FIELDS_MAP)
+    for field in encrypted_fields["fields"]:
+        if field["path"] == "encrypted_string":
+            for query in field["queries"]:
+                query["contention"] = contention
+    return encrypted_fields
+
+
+def insert_in_threads(collection):
+    # every thread inserts its own share of the batches, all into the same collection
+    results = [None] * INSERT_THREADS
+
+    def insert_share(thread):
+        generator = DocumentGenerator(seed=SEED + thread,
+            value_distribution=create_distribution(VALUE_DISTRIBUTION, VALUE_CARDINALITY))
+        results[thread] = timed_inserts(collection,
+            generator.batches(ITEMS_TO_CREATE, ITEMS_TO_CREATE * INSERT_BATCHES // INSERT_THREADS))
+
+    start_time = now_ns()
+    threads = [threading.Thread(target=insert_share, args=(thread,)) for thread in range(INSERT_THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = (now_ns() - start_time) / 1e9
+
+    histogram = LatencyHistogram()
+    for thread_histogram, _ in results:
+        histogram.merge(thread_histogram)
+    return histogram, histogram.count * ITEMS_TO_CREATE / elapsed
+
+
+def run_point(mongo_client, plain_client, contention):
+    collection_name = f"contention_{contention}"
+    print(f"Contention {contention}: creating {collection_name} and inserting...")
+    collection = recreate_encrypted_collection(mongo_client, collection_name,
+        encrypted_fields_with_contention(contention))
+
+    inserts, docs_per_second = insert_in_threads(collection)
+
+    print(f"Contention {contention}: querying...")
+    query_values = create_distribution("uniform", VALUE_CARDINALITY)
+    finds = timed_finds(collection,
+        ({ "encrypted_string": f"{query_values.next()}" } for i in range(QUERIES)))
+
+    storage = total_storage(plain_client, collection_name)
+    mongo_client[DB_NAME].drop_collection(collection_name)
+
+    insert_summary = inserts.summary_ms()
+    find_summary = finds.summary_ms()
+    inserts.save(f"contention_{contention}_inserts.json")
+    finds.save(f"contention_{contention}_finds.json")
+    return [contention, docs_per_second, insert_summary["p50"], insert_summary["p99"],
+        find_summary["p50"], find_summary["p99"], storage["stateCount"],
+        storage["stateSize"] / 2**20, (storage["storageSize"] + storage["totalIndexSize"]) / 2**20]
+
+
+if __name__ == "__main__":
+    mongo_client = create_client()
+    plain_client = create_plain_client()
+
+    rows = [run_point(mongo_client, plain_client, contention) for contention in CONTENTION_FACTORS]
+
+    print()
+    print_table(COLUMNS, rows)
+    write_table_csv("contention_sweep_output.csv", COLUMNS, rows)
+
+    plain_client.close()
+    mongo_client.close()
@@ -0,0 +1,83 @@
+"""
+Value distributions for the QE experiments.
+
+Real traffic isn't uniform. A few encrypted values tend to be very hot, and QE
+equality cost depends on how many documents share a value, so both the values
+we insert and the values we search for can be drawn from one of these:
+
+  * uniform    - every value equally likely
+  * zipfian    - value k has weight 1 / (k + 1) ** exponent, so 0 is the hottest
+  * hotspot    - hot_probability of the draws go to the first hot_fraction of
+                 the values, the rest are spread over the others
+  * sequential - 0, 1, 2, ... wrapping around at the cardinality
+
+Every distribution returns ints in range(cardinality) from next(). They are
+safe to share between threads.
+"""
+
+import itertools
+import random
+import threading
+
+
+DISTRIBUTIONS = ["uniform", "zipfian", "hotspot", "sequential"]
+
+
+class UniformDistribution:
+    def __init__(self, cardinality):
+        self.cardinality = cardinality
+
+    def next(self):
+        return random.randrange(self.cardinality)
+
+
+class ZipfianDistribution:
+    def __init__(self, cardinality, exponent=1.0):
+        self.cardinality = cardinality
+        self.values = range(cardinality)
+        self.cumulative_weights = list(itertools.accumulate(
+            1 / (k + 1) ** exponent for k in range(cardinality)))
+
+    def next(self):
+        return random.choices(self.values, cum_weights=self.cumulative_weights)[0]
+
+
+class HotspotDistribution:
+    def __init__(self, cardinality, hot_fraction=0.1, hot_probability=0.9):
+        self.cardinality = cardinality
+        self.hot_count = max(1, min(cardinality, round(cardinality * hot_fraction)))
+        self.hot_probability = hot_probability
+
+    def next(self):
+        if self.hot_count == self.cardinality or random.random() < self.hot_probability:
+            return random.randrange(self.hot_count)
+        return random.randrange(self.hot_count, self.cardinality)
+
+
+class SequentialDistribution:
+    def __init__(self, cardinality):
+        self.cardinality = cardinality
+        self.position = 0
+        self.lock = threading.Lock()
+
+    def advance(self, count):
+        # claims the next count draws and returns where they start
+        with self.lock:
+            start = self.position
+            self.position += count
+        return start
+
+    def next(self):
+        return self.advance(1) % self.cardinality
+
+
+def create_distribution(name, cardinality, exponent=1.0, hot_fraction=0.1, hot_probability=0.9):
+    if name == "uniform":
+        return UniformDistribution(cardinality)
+    elif name == "zipfian":
+        return ZipfianDistribution(cardinality, exponent)
+    elif name == "hotspot":
+        return HotspotDistribution(cardinality, hot_fraction, hot_probability)
+    elif name == "sequential":
+        return SequentialDistribution(cardinality)
+    raise Exception(f"Unknown distribution: {name} (try one of {', '.join(DISTRIBUTIONS)})")
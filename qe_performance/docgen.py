@@ -0,0 +1,142 @@
+"""
+Generates synthetic documents in big batches, fast enough that the generator
+isn't the bottleneck at multi-million-document scale.
+
+The other experiments build every word a character at a time with
+random.choice and every document on its own, which tops out at a few tens of
+thousands of documents per second. Here the random draws are done with NumPy
+a whole batch at a time, and the words and descriptions come out of
+vocabularies that are built once up front, so making a batch is mostly
+indexing into arrays and zipping the results into dicts.
+
+By default the name and description are the ones writer.py has always used
+("Item 7" and "This is item7.", numbered within the batch), so its numbers stay
+comparable with older runs. Pass text="words" for a random one-word name and a
+description_words word description instead, which is about four times as much
+plaintext per document.
+
+Everything is drawn from one seeded numpy.random.Generator, so the same seed
+gives the same documents.
+
+    generator = DocumentGenerator(seed=42)
+    for batch in generator.batches(200, 1_000_000):
+        collection.insert_many(batch)
+
+Run this module to see how many documents per second it makes.
+"""
+
+import numpy as np
+import time
+from distributions import UniformDistribution, ZipfianDistribution, HotspotDistribution, SequentialDistribution
+
+
+VOWELS = np.array(list("aeiou"), dtype=object)
+CONSONANTS = np.array(list("bcdfghjklmnpqrstvwxyz"), dtype=object)
+
+
+def build_vocabulary(rng, size, min_length=4, max_length=8):
+    """
+    Nonsense words with alternating consonants and vowels, like
+    generate_nonsense_word in the other experiments.
+    """
+
+    lengths = rng.integers(min_length, max_length + 1, size)
+    consonants = CONSONANTS[rng.integers(0, len(CONSONANTS), (size, max_length))]
+    vowels = VOWELS[rng.integers(0, len(VOWELS), (size, max_length))]
+    letters = np.where(np.arange(max_length) % 2 == 0, consonants, vowels)  # even indices get a consonant
+    return ["".join(word[:length]) for word, length in zip(letters.tolist(), lengths.tolist())]
+
+
+def make_sampler(distribution):
+    """
+    Returns a function (rng, count) -> array of ints that draws a batch of
+    values from one of the distributions in distributions.py.
+    """
+
+    cardinality = distribution.cardinality
+    if isinstance(distribution, UniformDistribution):
+        return lambda rng, count: rng.integers(0, cardinality, count)
+    elif isinstance(distribution, ZipfianDistribution):
+        cumulative_weights = np.asarray(distribution.cumulative_weights)
+        total = cumulative_weights[-1]
+        return lambda rng, count: np.searchsorted(
+            cumulative_weights, rng.random(count) * total, side="right")
+    elif isinstance(distribution, HotspotDistribution):
+        hot_count = distribution.hot_count
+        if hot_count == cardinality:
+            return lambda rng, count: rng.integers(0, cardinality, count)
+        def sample_hotspot(rng, count):
+            hot = rng.random(count) < distribution.hot_probability
+            return np.where(hot, rng.integers(0, hot_count, count),
+                rng.integers(hot_count, cardinality, count))
+        return sample_hotspot
+    elif isinstance(distribution, SequentialDistribution):
+        return lambda rng, count: (distribution.advance(count) + np.arange(count)) % cardinality
+    raise Exception(f"Don't know how to sample {type(distribution).__name__} in bulk.")
+
+
+class DocumentGenerator:
+    """
+    Makes documents shaped like the ones writer.py inserts: a name, a
+    description and an encrypted_string drawn from value_distribution (uniform
+    over 0..199 by default). text is "items" for writer.py's "Item i" and
+    "This is item{i}." or "words" for nonsense words.
+    """
+
+    def __init__(self, seed=0, value_distribution=None, text="items", description_words=20,
+                 vocabulary_size=4096, description_pool_size=16384):
+        if text not in ["items", "words"]:
+            raise Exception(f"Unknown text: {text}")
+        self.rng = np.random.default_rng(seed)
+        if value_distribution is None:
+            value_distribution = UniformDistribution(200)
+        self.sample_values = make_sampler(value_distribution)
+        self.value_strings = np.array(
+            [f"{value}" for value in range(value_distribution.cardinality)], dtype=object)
+
+        self.text = text
+        self.items = {}  # count -> (names, descriptions)
+        if text == "words":
+            self.vocabulary = np.array(build_vocabulary(self.rng, vocabulary_size), dtype=object)
+            words = self.vocabulary[self.rng.integers(0, vocabulary_size, (description_pool_size, description_words))]
+            self.descriptions = np.array([" ".join(description) for description in words.tolist()], dtype=object)
+
+    def item_text(self, count):
+        if count not in self.items:
+            self.items[count] = ([f"Item {i}" for i in range(count)], [f"This is item{i}." for i in range(count)])
+        return self.items[count]
+
+    def generate(self, count):
+        if self.text == "items":
+            names, descriptions = self.item_text(count)
+        else:
+            names = self.vocabulary[self.rng.integers(0, len(self.vocabulary), count)].tolist()
+            descriptions = self.descriptions[self.rng.integers(0, len(self.descriptions), count)].tolist()
+        values = self.value_strings[self.sample_values(self.rng, count)].tolist()
+        return [
+            { "name": name, "description": description, "encrypted_string": value }
+            for name, description, value in zip(names, descriptions, values)
+        ]
+
+    def batches(self, batch_size, total):
+        """
+        Yields lists of ready-to-insert documents until total have been made.
+        """
+
+        remaining = total
+        while remaining > 0:
+            batch = self.generate(min(batch_size, remaining))
+            remaining -= len(batch)
+            yield batch
+
+
+if __name__ == "__main__":
+    DOCUMENTS = 5_000_000
+    BATCH_SIZE = 10_000
+
+    for text in ["items", "words"]:
+        generator = DocumentGenerator(seed=42, text=text)
+        start_time = time.perf_counter()
+        made = sum(len(batch) for batch in generator.batches(BATCH_SIZE, DOCUMENTS))
+        elapsed = time.perf_counter() - start_time
+        print(f"Generated {made} {text} documents in {elapsed:.2f} s, {made / elapsed:,.0f} docs/s.")
@@ -0,0 +1,130 @@
+"""
+How fast is ClientEncryption.encrypt (and decrypt) on its own? No server is
+involved beyond fetching the data key once, so this is libmongocrypt plus the
+driver's BSON handling.
+
+    python encrypt_bench.py
+
+For every combination of algorithm, value type and (for strings) payload size
+in CASES, this encrypts OPERATIONS values on one thread and then spread over
+each of THREAD_COUNTS threads in a pool. If libmongocrypt releases the GIL the
+threaded runs go faster, and the speedup column shows by how much.
+
+  * Indexed   - equality insert payloads (int, long, string)
+  * Unindexed - encrypted but not queryable (int, long, decimal, string)
+  * Range     - range insert payloads (int, long, decimal)
+
+Only Unindexed values are decrypted too. Indexed and Range encrypt produces
+insert payloads, which the server turns into the stored values, so there is
+nothing to decrypt on the client.
+
+Results are printed and written to encrypt_bench_output.csv and, one object
+per row, encrypt_bench_output.json.
+"""
+
+import json
+import random
+import string
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from bson import Decimal128, Int64
+from pymongo.encryption import Algorithm, RangeOpts
+from latency import now_ns
+from sweeps import print_table, write_table_csv
+from utils import create_plain_client, create_client_encryption, KMS_PROVIDER_NAME
+
+OPERATIONS = 10000  # per case and thread count
+THREAD_COUNTS = [1, 2, 4, 8]
+STRING_SIZES = [16, 256, 4096, 65536]  # bytes
+CONTENTION = 8
+SEED = 0
+
+RANGE_OPTS = {
+    "int": RangeOpts(min=0, max=1000000, sparsity=1, trim_factor=6),
+    "long": RangeOpts(min=Int64(0), max=Int64(10**15), sparsity=1, trim_factor=6),
+    "decimal": RangeOpts(min=Decimal128("0.00"), max=Decimal128("10000.00"), precision=2,
+        sparsity=1, trim_factor=6),
+}
+
+CASES = (
+    [(Algorithm.INDEXED, value_type, None) for value_type in ["int", "long"]] +
+    [(Algorithm.INDEXED, "string", size) for size in STRING_SIZES] +
+    [(Algorithm.UNINDEXED, value_type, None) for value_type in ["int", "long", "decimal"]] +
+    [(Algorithm.UNINDEXED, "string", size) for size in STRING_SIZES] +
+    [(Algorithm.RANGE, value_type, None) for value_type in ["int", "long", "decimal"]]
+)
+
+COLUMNS = ["algorithm", "type", "size", "threads", "encrypt ops/s", "encrypt speedup",
+           "decrypt ops/s", "decrypt speedup"]
+
+
+def generate_values(value_type, size, rng):
+    if value_type == "int":
+        return [rng.randint(0, 1000000) for i in range(OPERATIONS)]
+    elif value_type == "long":
+        return [Int64(rng.randint(0, 10**15)) for i in range(OPERATIONS)]
+    elif value_type == "decimal":
+        return [Decimal128(Decimal(rng.randint(0, 1000000)).scaleb(-2)) for i in range(OPERATIONS)]
+    # only a few distinct strings, since making big ones is slow
+    strings = ["".join(rng.choices(string.ascii_letters, k=size)) for i in range(100)]
+    return [strings[i % len(strings)] for i in range(OPERATIONS)]
+
+
+def encrypt_function(client_encryption, key_id, algorithm, value_type):
+    options = { "key_id": key_id }
+    if algorithm != Algorithm.UNINDEXED:
+        options["contention_factor"] = CONTENTION
+    if algorithm == Algorithm.RANGE:
+        options["range_opts"] = RANGE_OPTS[value_type]
+    return lambda value: client_encryption.encrypt(value, algorithm, **options)
+
+
+def operations_per_second(function, values, threads):
+    if threads == 1:
+        start_time = now_ns()
+        results = [function(value) for value in values]
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            start_time = now_ns()
+            results = list(executor.map(function, values, chunksize=max(len(values) // (threads * 16), 1)))
+    return len(values) * 1e9 / (now_ns() - start_time), results
+
+
+def run_case(client_encryption, key_id, algorithm, value_type, size):
+    print(f"Benchmarking {algorithm.value} {value_type}" + (f" of {size} bytes" if size else "") + "...")
+    values = generate_values(value_type, size, random.Random(SEED))
+    encrypt = encrypt_function(client_encryption, key_id, algorithm, value_type)
+    encrypt(values[0])  # so the data key is already cached
+
+    rows = []
+    single = None
+    for threads in THREAD_COUNTS:
+        encrypt_rate, ciphertexts = operations_per_second(encrypt, values, threads)
+        decrypt_rate = None
+        if algorithm == Algorithm.UNINDEXED:
+            decrypt_rate, _ = operations_per_second(client_encryption.decrypt, ciphertexts, threads)
+        if single is None:
+            single = (encrypt_rate, decrypt_rate)
+        rows.append([algorithm.value, value_type, size or "", threads, encrypt_rate, encrypt_rate / single[0],
+            decrypt_rate or "", decrypt_rate / single[1] if decrypt_rate else ""])
+    return rows
+
+
+if __name__ == "__main__":
+    key_vault_client = create_plain_client()
+    client_encryption = create_client_encryption(key_vault_client)
+    key_id = client_encryption.create_data_key(KMS_PROVIDER_NAME)
+
+    rows = []
+    for algorithm, value_type, size in CASES:
+        rows += run_case(client_encryption, key_id, algorithm, value_type, size)
+
+    print()
+    print_table(COLUMNS, rows)
+    write_table_csv("encrypt_bench_output.csv", COLUMNS, rows)
+    with open("encrypt_bench_output.json", "w") as file:
+        json.dump([dict(zip(COLUMNS, row)) for row in rows], file, indent=2)
+
+    client_encryption.delete_key(key_id)
+    client_encryption.close()
+    key_vault_client.close()
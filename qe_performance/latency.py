@@ -0,0 +1,142 @@
+"""
+Latency recording for the QE performance experiments.
+
+Rather than writing one CSV row per operation and working out percentiles
+afterwards, we count latencies into log-bucketed histograms, the same idea as
+HdrHistogram. Each power of two is split into SUB_BUCKET_COUNT linear buckets,
+so any recorded value is off by less than 1% and a histogram covering
+nanoseconds to hours only needs a few thousand counters.
+
+Histograms from different threads or processes can be merged, and they can be
+saved to and loaded from JSON.
+
+Times are taken with time.perf_counter_ns(), which is monotonic.
+"""
+
+import json
+import time
+
+
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS  # 128 buckets per power of two
+
+PERCENTILES = [50, 90, 99, 99.9]
+
+NANOSECONDS_PER_MILLISECOND = 1_000_000
+
+
+def now_ns():
+    return time.perf_counter_ns()
+
+
+def bucket_index(value):
+    shift = max(value.bit_length() - SUB_BUCKET_BITS - 1, 0)
+    return (shift << SUB_BUCKET_BITS) + (value >> shift)
+
+
+def bucket_range(index):
+    # the lowest and highest values that land in the given bucket
+    shift = max((index >> SUB_BUCKET_BITS) - 1, 0)
+    mantissa = index - (shift << SUB_BUCKET_BITS)
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    A histogram of latencies in nanoseconds. Not thread safe, so give each
+    worker its own and merge them at the end.
+    """
+
+    def __init__(self):
+        self.counts = {}  # bucket index -> count
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value_ns):
+        index = bucket_index(value_ns)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value_ns
+        if self.min is None or value_ns < self.min:
+            self.min = value_ns
+        if value_ns > self.max:
+            self.max = value_ns
+
+    def record_since(self, start_ns):
+        elapsed_ns = now_ns() - start_ns
+        self.record(elapsed_ns)
+        return elapsed_ns
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+        return self
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        if self.count == 0:
+            return 0
+        target = max(1, round(self.count * percent / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(bucket_range(index)[1], self.max)
+        return self.max
+
+    def count_at_most(self, value_ns):
+        # how many recorded values were no more than value_ns (to within a bucket)
+        return sum(count for index, count in self.counts.items() if bucket_range(index)[1] <= value_ns)
+
+    def summary_ms(self):
+        summary = { "count": self.count, "mean": self.mean() / NANOSECONDS_PER_MILLISECOND }
+        for percent in PERCENTILES:
+            summary[f"p{percent}"] = self.percentile(percent) / NANOSECONDS_PER_MILLISECOND
+        summary["max"] = self.max / NANOSECONDS_PER_MILLISECOND
+        return summary
+
+    def print_summary(self, name):
+        summary = self.summary_ms()
+        print(f"{name}: {summary['count']} ops, mean {summary['mean']:.2f} ms, " +
+              ", ".join(f"p{p} {summary[f'p{p}']:.2f} ms" for p in PERCENTILES) +
+              f", max {summary['max']:.2f} ms")
+
+    def to_dict(self):
+        return {
+            "sub_bucket_bits": SUB_BUCKET_BITS,
+            "counts": { str(index): count for index, count in self.counts.items() },
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data["sub_bucket_bits"] != SUB_BUCKET_BITS:
+            raise Exception("Histogram was saved with a different bucket layout.")
+        histogram = cls()
+        histogram.counts = { int(index): count for index, count in data["counts"].items() }
+        histogram.count = data["count"]
+        histogram.total = data["total"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        return histogram
+
+    def save(self, filename):
+        with open(filename, "w") as file:
+            json.dump(self.to_dict(), file)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as file:
+            return cls.from_dict(json.load(file))
@@ -0,0 +1,185 @@
+"""
+Loads a real dataset into an encrypted collection as fast as the client can
+encrypt it.
+
+    python loader.py data.ndjson [collection]
+    python loader.py data.csv [collection]
+
+The collection defaults to ENCRYPTED_COLLECTION and is created with
+ENCRYPTED_FIELDS_MAP if it doesn't exist. NDJSON lines are parsed as extended
+JSON, so {"$date": ...} and friends work. CSV values stay strings, and a
+dotted header like patientRecord.ssn becomes a nested field.
+
+It's a pipeline, so parsing, encryption and network I/O overlap. A parser
+thread reads the file lazily into batches of BATCH_SIZE documents and puts
+them on a queue, and INSERT_THREADS threads take them off and bulk_write them
+unordered, so batch N+1 is being parsed and encrypted while batch N is in
+flight. The queue holds at most QUEUE_BATCHES batches, and when it's full the
+parser waits (backpressure), so memory stays flat however big the file is.
+
+Every PROGRESS_SECONDS it prints the documents loaded so far, the recent and
+overall docs/s, how full the queue is and how often the parser had to wait.
+A summary line goes to loader_output.csv at the end. If a line can't be
+parsed, the batches before it are still loaded and then it stops with the
+error.
+"""
+
+import csv
+import queue
+import sys
+import threading
+import time
+from bson import json_util
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+from utils import create_client, create_encrypted_collection, does_collection_exist, set_path, DB_NAME, ENCRYPTED_COLLECTION, ENCRYPTED_FIELDS_MAP, write_line_to_csv
+
+BATCH_SIZE = 1000  # documents per bulk_write
+INSERT_THREADS = 4  # bulk_writes in flight at once
+QUEUE_BATCHES = 8  # parsed batches waiting for an insert thread
+PROGRESS_SECONDS = 5
+
+
+def read_ndjson(file):
+    for line in file:
+        if line.strip():
+            yield json_util.loads(line)
+
+
+def read_csv(file):
+    reader = csv.DictReader(file)
+    for row in reader:
+        if None in row:
+            raise Exception(f"Line {reader.line_num} has more values than the header has columns.")
+        document = {}
+        for path, value in row.items():
+            if value != "":
+                set_path(document, path, value)
+        yield document
+
+
+def read_documents(filename):
+    reader = read_csv if filename.endswith(".csv") else read_ndjson
+    with open(filename, newline="") as file:
+        yield from reader(file)
+
+
+class LoadStats:
+    """
+    Counters shared by the pipeline threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.parsed = 0
+        self.inserted = 0
+        self.errors = 0
+        self.stalls = 0  # times the parser found the queue full
+        self.failed_threads = 0
+        self.parser_error = None
+        self.start_time = time.time()
+
+    def add(self, **counts):
+        with self.lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+
+def parse_batches(filename, batches, stats):
+    try:
+        batch = []
+        for document in read_documents(filename):
+            batch.append(InsertOne(document))
+            if len(batch) == BATCH_SIZE:
+                put_batch(batches, batch, stats)
+                batch = []
+        if batch:
+            put_batch(batches, batch, stats)
+    except Exception as error:
+        stats.parser_error = error  # load() raises it once the insert threads are done
+    finally:
+        for i in range(INSERT_THREADS):
+            batches.put(None)  # one for each insert thread to stop on
+
+
+def put_batch(batches, batch, stats):
+    stats.add(parsed=len(batch))
+    try:
+        batches.put_nowait(batch)
+    except queue.Full:
+        stats.add(stalls=1)
+        batches.put(batch)  # wait for an insert thread to catch up
+
+
+def insert_batches(collection, batches, stats):
+    while True:
+        batch = batches.get()
+        if batch is None:
+            return
+        try:
+            result = collection.bulk_write(batch, ordered=False)
+            stats.add(inserted=result.inserted_count)
+        except BulkWriteError as error:
+            # unordered, so everything but the failures went in
+            stats.add(inserted=error.details["nInserted"], errors=len(error.details["writeErrors"]))
+        except Exception:
+            stats.add(failed_threads=1)
+            raise
+
+
+def report_progress(stats, batches, last):
+    now = time.time()
+    recent = (stats.inserted - last[1]) / (now - last[0])
+    overall = stats.inserted / (now - stats.start_time)
+    print(f"{stats.inserted} documents loaded, {recent:.1f} docs/s recently, {overall:.1f} docs/s overall, "
+          f"{batches.qsize()} of {QUEUE_BATCHES} batches queued, parser waited {stats.stalls} times, "
+          f"{stats.errors} errors")
+    return now, stats.inserted
+
+
+def load(filename, collection):
+    stats = LoadStats()
+    batches = queue.Queue(maxsize=QUEUE_BATCHES)
+    parser = threading.Thread(target=parse_batches, args=(filename, batches, stats), daemon=True)
+    inserters = [threading.Thread(target=insert_batches, args=(collection, batches, stats), daemon=True)
+                 for i in range(INSERT_THREADS)]
+    parser.start()
+    for inserter in inserters:
+        inserter.start()
+
+    last = (stats.start_time, 0)
+    for inserter in inserters:
+        while inserter.is_alive():
+            inserter.join(PROGRESS_SECONDS)
+            if time.time() - last[0] >= PROGRESS_SECONDS:
+                last = report_progress(stats, batches, last)
+    if stats.failed_threads:
+        # the parser might be stuck waiting on a full queue, but it's a daemon
+        raise Exception(f"{stats.failed_threads} insert thread(s) failed, see above.")
+    parser.join()
+    if stats.parser_error is not None:
+        raise Exception(f"Couldn't parse {filename} after {stats.parsed} documents "
+            f"({stats.inserted} loaded): {stats.parser_error}") from stats.parser_error
+
+    elapsed = time.time() - stats.start_time
+    docs_per_second = stats.inserted / elapsed if elapsed else 0
+    print(f"Loaded {stats.inserted} of {stats.parsed} documents from {filename} in {elapsed:.1f} s "
+          f"({docs_per_second:.1f} docs/s), {stats.errors} errors, parser waited {stats.stalls} times.")
+    # file, collection, documents parsed, documents inserted, errors, parser stalls, elapsed (s), docs/s
+    write_line_to_csv("loader_output.csv", [filename, collection.name, stats.parsed, stats.inserted,
+        stats.errors, stats.stalls, elapsed, docs_per_second])
+    return stats
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in [2, 3]:
+        print("usage: python loader.py <file.ndjson | file.csv> [collection]")
+        sys.exit(1)
+    collection_name = sys.argv[2] if len(sys.argv) == 3 else ENCRYPTED_COLLECTION
+
+    mongo_client = create_client()
+    if not does_collection_exist(mongo_client, DB_NAME, collection_name):
+        print(f"Creating {collection_name} with ENCRYPTED_FIELDS_MAP...")
+        create_encrypted_collection(mongo_client, collection_name, ENCRYPTED_FIELDS_MAP)
+    load(sys.argv[1], mongo_client[DB_NAME].get_collection(collection_name))
+    mongo_client.close()
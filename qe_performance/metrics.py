@@ -0,0 +1,163 @@
+"""
+Live metrics for long runs, served over HTTP in the OpenMetrics text format so
+the same Prometheus and Grafana setup we use in production can scrape them.
+
+    registry = start_metrics_server(9464)
+    registry.start("find")
+    ...
+    registry.finish("find", elapsed_ns, error=False)
+
+and then http://localhost:9464/metrics has, per operation:
+
+  * qe_operations_total and qe_operation_errors_total
+  * qe_operations_in_flight
+  * qe_operation_duration_seconds - a histogram with DURATION_BUCKETS_SECONDS
+  * qe_operation_latency_seconds  - a summary with p50, p90, p99 and p99.9
+
+and qe_network_sent_bytes_total and qe_network_received_bytes_total for every
+MongoClient created after the server started. The byte counts come from
+command monitoring, which means encoding each command and reply a second time
+just to measure it, so they cost a little client CPU. They're the sizes of the
+commands after encryption.
+
+reader.py and writer.py start one when METRICS_PORT is set.
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bson
+from pymongo import monitoring
+from latency import LatencyHistogram, PERCENTILES
+
+DURATION_BUCKETS_SECONDS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+class MetricsRegistry:
+    """
+    Operation counts, errors, in-flight operations and latencies, safe to use
+    from any thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {}  # operation -> { "latency", "errors", "in_flight" }
+        self.sent_bytes = 0
+        self.received_bytes = 0
+
+    def _operation(self, operation):
+        if operation not in self.operations:
+            self.operations[operation] = { "latency": LatencyHistogram(), "errors": 0, "in_flight": 0 }
+        return self.operations[operation]
+
+    def start(self, operation):
+        with self.lock:
+            self._operation(operation)["in_flight"] += 1
+
+    def finish(self, operation, elapsed_ns, error=False):
+        with self.lock:
+            stats = self._operation(operation)
+            stats["in_flight"] -= 1
+            stats["latency"].record(elapsed_ns)
+            stats["errors"] += error
+
+    def add_bytes(self, sent=0, received=0):
+        with self.lock:
+            self.sent_bytes += sent
+            self.received_bytes += received
+
+    def render(self):
+        with self.lock:
+            lines = []
+            family(lines, "qe_operations", "counter", "Operations finished.")
+            for operation, stats in self.operations.items():
+                lines.append(f'qe_operations_total{{operation="{operation}"}} {stats["latency"].count}')
+            family(lines, "qe_operation_errors", "counter", "Operations that raised.")
+            for operation, stats in self.operations.items():
+                lines.append(f'qe_operation_errors_total{{operation="{operation}"}} {stats["errors"]}')
+            family(lines, "qe_operations_in_flight", "gauge", "Operations started but not finished.")
+            for operation, stats in self.operations.items():
+                lines.append(f'qe_operations_in_flight{{operation="{operation}"}} {stats["in_flight"]}')
+
+            family(lines, "qe_operation_duration_seconds", "histogram", "Operation latency.", "seconds")
+            for operation, stats in self.operations.items():
+                histogram = stats["latency"]
+                for bound in DURATION_BUCKETS_SECONDS:
+                    lines.append(f'qe_operation_duration_seconds_bucket{{operation="{operation}",le="{float(bound)}"}} '
+                                 f'{histogram.count_at_most(int(bound * 1e9))}')
+                lines.append(f'qe_operation_duration_seconds_bucket{{operation="{operation}",le="+Inf"}} {histogram.count}')
+                lines.append(f'qe_operation_duration_seconds_count{{operation="{operation}"}} {histogram.count}')
+                lines.append(f'qe_operation_duration_seconds_sum{{operation="{operation}"}} {histogram.total / 1e9}')
+
+            family(lines, "qe_operation_latency_seconds", "summary", "Operation latency percentiles.", "seconds")
+            for operation, stats in self.operations.items():
+                histogram = stats["latency"]
+                for percent in PERCENTILES:
+                    lines.append(f'qe_operation_latency_seconds{{operation="{operation}",quantile="{percent / 100:g}"}} '
+                                 f'{histogram.percentile(percent) / 1e9}')
+                lines.append(f'qe_operation_latency_seconds_count{{operation="{operation}"}} {histogram.count}')
+                lines.append(f'qe_operation_latency_seconds_sum{{operation="{operation}"}} {histogram.total / 1e9}')
+
+            family(lines, "qe_network_sent_bytes", "counter", "Bytes of commands sent.", "bytes")
+            lines.append(f"qe_network_sent_bytes_total {self.sent_bytes}")
+            family(lines, "qe_network_received_bytes", "counter", "Bytes of replies received.", "bytes")
+            lines.append(f"qe_network_received_bytes_total {self.received_bytes}")
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def family(lines, name, metric_type, description, unit=None):
+    lines.append(f"# TYPE {name} {metric_type}")
+    if unit is not None:
+        lines.append(f"# UNIT {name} {unit}")
+    lines.append(f"# HELP {name} {description}")
+
+
+class ByteCounter(monitoring.CommandListener):
+    """
+    Adds the encoded size of every command and reply to a MetricsRegistry.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def started(self, event):
+        self.registry.add_bytes(sent=len(bson.encode(event.command)))
+
+    def succeeded(self, event):
+        self.registry.add_bytes(received=len(bson.encode(event.reply)))
+
+    def failed(self, event):
+        pass
+
+
+def start_metrics_server(port, registry=None):
+    """
+    Serves registry (or a new one) at http://localhost:<port>/metrics from a
+    background thread and returns it.
+    """
+
+    if registry is None:
+        registry = MetricsRegistry()
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # a scrape every few seconds would drown out the benchmark's output
+
+    server = ThreadingHTTPServer(("localhost", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monitoring.register(ByteCounter(registry))
+    print(f"Serving metrics at http://localhost:{port}/metrics")
+    return registry
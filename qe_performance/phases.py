@@ -0,0 +1,223 @@
+"""
+Splits an automatically encrypted insert_many or find into phases, so we can
+tell whether the time went to the client or to the cluster.
+
+The wire portions come from pymongo command monitoring:
+
+  * metadata  - listCollections, which the driver uses to learn encryptedFields
+  * key_vault - finds against the key vault for data encryption keys
+  * server    - the round trips for the operation itself
+
+The client portions can't be seen from inside automatic encryption, so we time
+the explicit ClientEncryption equivalents of the same operation and subtract:
+
+  * encryption     - ClientEncryption.encrypt of the same values
+  * decryption     - decrypting and decoding the results, measured with a
+                     bypass_query_analysis client doing the same find
+  * query_analysis - whatever client time is left over, which is mostly
+                     crypt_shared marking (so this one is an estimate)
+
+Phases that don't apply to an operation are recorded as zero, so that every
+phase histogram has one entry per operation.
+"""
+
+import json
+import threading
+from pymongo import monitoring
+from pymongo.encryption import Algorithm, QueryType
+from latency import LatencyHistogram, now_ns
+from utils import create_client, create_plain_client, create_client_encryption, create_auto_encryption_options, KEY_VAULT_DATABASE
+
+
+PHASES = ["metadata", "key_vault", "query_analysis", "encryption", "server", "decryption"]
+
+DEFAULT_CONTENTION = 8  # what the server uses when encryptedFields doesn't say
+
+
+class CommandTimer(monitoring.CommandListener):
+    """
+    Adds up command durations per phase for the current thread. Call take() to
+    get the totals (in nanoseconds) since the last take().
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def _totals(self):
+        if not hasattr(self.local, "totals"):
+            self.local.totals = {}
+        return self.local.totals
+
+    def _add(self, event):
+        if event.database_name == KEY_VAULT_DATABASE:
+            phase = "key_vault"
+        elif event.command_name == "listCollections":
+            phase = "metadata"
+        else:
+            phase = "server"
+        totals = self._totals()
+        totals[phase] = totals.get(phase, 0) + 1000 * event.duration_micros
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._add(event)
+
+    def failed(self, event):
+        self._add(event)
+
+    def take(self):
+        totals = self._totals()
+        self.local.totals = {}
+        return totals
+
+
+class PhaseRecorder:
+    """
+    One LatencyHistogram per phase, plus one for the whole operation.
+    """
+
+    def __init__(self):
+        self.histograms = { phase: LatencyHistogram() for phase in PHASES + ["total"] }
+
+    def record(self, phases_ns):
+        for phase, histogram in self.histograms.items():
+            histogram.record(phases_ns.get(phase, 0))
+
+    def merge(self, other):
+        for phase, histogram in self.histograms.items():
+            histogram.merge(other.histograms[phase])
+        return self
+
+    def print_summary(self, name):
+        print(f"{name}, by phase:")
+        for phase, histogram in self.histograms.items():
+            histogram.print_summary(f"  {phase:>14}")
+
+    def to_dict(self):
+        return { phase: histogram.to_dict() for phase, histogram in self.histograms.items() }
+
+    @classmethod
+    def from_dict(cls, data):
+        recorder = cls()
+        recorder.histograms = { phase: LatencyHistogram.from_dict(histogram) for phase, histogram in data.items() }
+        return recorder
+
+    def save(self, filename):
+        with open(filename, "w") as file:
+            json.dump(self.to_dict(), file)
+
+
+def encrypted_field_info(mongo_client, db_name, collection_name, path):
+    """
+    Returns the key id and contention factor for an equality field.
+    """
+
+    info = next(mongo_client[db_name].list_collections(filter={ "name": collection_name }))
+    for field in info["options"]["encryptedFields"]["fields"]:
+        if field["path"] == path:
+            queries = field.get("queries", [])
+            if isinstance(queries, dict):
+                queries = [queries]
+            contention = DEFAULT_CONTENTION
+            for query in queries:
+                if query["queryType"] == "equality":
+                    contention = query.get("contention", DEFAULT_CONTENTION)
+            return field["keyId"], contention
+    raise Exception(f"{path} is not an encrypted field of {db_name}.{collection_name}.")
+
+
+class PhaseInstrumentation:
+    """
+    Owns the clients needed to measure phases for one encrypted field. Use one
+    per thread or process.
+    """
+
+    def __init__(self, db_name, collection_name, path):
+        self.path = path
+        self.timer = CommandTimer()
+        self.key_vault_client = create_plain_client(event_listeners=[self.timer])
+        self.auto_client = create_client(
+            create_auto_encryption_options(key_vault_client=self.key_vault_client),
+            event_listeners=[self.timer])
+        self.explicit_client = create_client(
+            create_auto_encryption_options(key_vault_client=self.key_vault_client, bypass_query_analysis=True),
+            event_listeners=[self.timer])
+        self.client_encryption = create_client_encryption(self.key_vault_client)
+
+        self.auto_collection = self.auto_client[db_name].get_collection(collection_name)
+        self.explicit_collection = self.explicit_client[db_name].get_collection(collection_name)
+        self.key_id, self.contention = encrypted_field_info(
+            self.key_vault_client, db_name, collection_name, path)
+        self.timer.take()
+
+    def _time_encrypt(self, values, query_type=None):
+        # returns the encryption time with key vault round trips taken out
+        start_time = now_ns()
+        payloads = [
+            self.client_encryption.encrypt(value, Algorithm.INDEXED, self.key_id,
+                query_type=query_type, contention_factor=self.contention)
+            for value in values
+        ]
+        elapsed = now_ns() - start_time
+        return payloads, max(elapsed - self.timer.take().get("key_vault", 0), 0)
+
+    def measure_find(self, value):
+        """
+        Runs the find both ways and returns (results, phases in nanoseconds).
+        """
+
+        self.timer.take()
+        start_time = now_ns()
+        results = list(self.auto_collection.find({ self.path: value }))
+        total = now_ns() - start_time
+        wire = self.timer.take()
+
+        payloads, encryption = self._time_encrypt([value], QueryType.EQUALITY)
+
+        start_time = now_ns()
+        list(self.explicit_collection.find({ self.path: payloads[0] }))
+        explicit_total = now_ns() - start_time
+        decryption = max(explicit_total - sum(self.timer.take().values()), 0)
+
+        client_side = total - sum(wire.values())
+        return results, {
+            "metadata": wire.get("metadata", 0),
+            "key_vault": wire.get("key_vault", 0),
+            "query_analysis": max(client_side - encryption - decryption, 0),
+            "encryption": encryption,
+            "server": wire.get("server", 0),
+            "decryption": decryption,
+            "total": total,
+        }
+
+    def measure_insert_many(self, documents):
+        """
+        Inserts the documents with automatic encryption and returns the phases
+        in nanoseconds. The explicit encryption is only timed, not inserted.
+        """
+
+        self.timer.take()
+        start_time = now_ns()
+        self.auto_collection.insert_many(documents)
+        total = now_ns() - start_time
+        wire = self.timer.take()
+
+        _, encryption = self._time_encrypt([document[self.path] for document in documents])
+
+        client_side = total - sum(wire.values())
+        return {
+            "metadata": wire.get("metadata", 0),
+            "key_vault": wire.get("key_vault", 0),
+            "query_analysis": max(client_side - encryption, 0),
+            "encryption": encryption,
+            "server": wire.get("server", 0),
+            "total": total,
+        }
+
+    def close(self):
+        self.client_encryption.close()
+        self.explicit_client.close()
+        self.auto_client.close()
+        self.key_vault_client.close()
@@ -0,0 +1,134 @@
+"""
+An explicit encryption path for equality finds that encrypts each query value
+once and reuses the payload, instead of going through query analysis and
+token derivation on every find like automatic encryption does.
+
+    python query_cache.py
+
+The reader only ever searches VALUE_CARDINALITY distinct values, so after a
+short warm-up every find can be a cache hit. Payloads are kept in a bounded
+LRU (CACHE_CAPACITY entries, keyed by value) for one field, key and contention
+factor, and sent through a bypass_query_analysis client. Results are still
+decrypted automatically.
+
+Run writer.py first. The benchmark interleaves automatic and cached finds,
+swapping which goes first each time, prints both latency summaries with the
+cache hit rate and writes them to query_cache_output.csv.
+"""
+
+import threading
+from collections import OrderedDict
+from pymongo.encryption import Algorithm, QueryType
+from distributions import create_distribution
+from latency import LatencyHistogram, now_ns
+from phases import encrypted_field_info
+from utils import create_client, create_plain_client, create_client_encryption, create_auto_encryption_options, DB_NAME, ENCRYPTED_COLLECTION, write_line_to_csv
+
+QUERIES = 10000
+CACHE_CAPACITY = 1000  # payloads, should be at least VALUE_CARDINALITY to hit every time
+VALUE_CARDINALITY = 200  # the same values the writer inserts
+QUERY_DISTRIBUTION = "uniform"  # see distributions.py
+FIELD = "encrypted_string"
+
+
+class QueryPayloadCache:
+    """
+    A thread-safe LRU of encrypted equality find payloads for one field.
+    """
+
+    def __init__(self, client_encryption, key_id, contention, capacity=CACHE_CAPACITY):
+        self.client_encryption = client_encryption
+        self.key_id = key_id
+        self.contention = contention
+        self.capacity = capacity
+        self.payloads = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def payload(self, value):
+        with self.lock:
+            if value in self.payloads:
+                self.payloads.move_to_end(value)
+                self.hits += 1
+                return self.payloads[value]
+            self.misses += 1
+
+        # encrypt outside the lock, two threads missing on the same value both
+        # encrypt it and the second one wins, which is harmless
+        payload = self.client_encryption.encrypt(value, Algorithm.INDEXED, self.key_id,
+            query_type=QueryType.EQUALITY, contention_factor=self.contention)
+
+        with self.lock:
+            self.payloads[value] = payload
+            self.payloads.move_to_end(value)
+            while len(self.payloads) > self.capacity:
+                self.payloads.popitem(last=False)
+        return payload
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+
+class CachedEqualityQuery:
+    """
+    Owns the clients for cached explicit finds on one encrypted field.
+    """
+
+    def __init__(self, db_name, collection_name, path, capacity=CACHE_CAPACITY):
+        self.path = path
+        self.key_vault_client = create_plain_client()
+        self.client = create_client(create_auto_encryption_options(
+            key_vault_client=self.key_vault_client, bypass_query_analysis=True))
+        self.client_encryption = create_client_encryption(self.key_vault_client)
+        self.collection = self.client[db_name].get_collection(collection_name)
+        key_id, contention = encrypted_field_info(self.key_vault_client, db_name, collection_name, path)
+        self.cache = QueryPayloadCache(self.client_encryption, key_id, contention, capacity)
+
+    def find(self, value, *args, **kwargs):
+        return self.collection.find({ self.path: self.cache.payload(value) }, *args, **kwargs)
+
+    def close(self):
+        self.client_encryption.close()
+        self.client.close()
+        self.key_vault_client.close()
+
+
+def report(name, histogram):
+    histogram.print_summary(name)
+    summary = histogram.summary_ms()
+    # path, queries, mean, p50, p90, p99, p99.9, max (ms)
+    write_line_to_csv("query_cache_output.csv", [name, summary["count"], summary["mean"],
+        summary["p50"], summary["p90"], summary["p99"], summary["p99.9"], summary["max"]])
+
+
+if __name__ == "__main__":
+    mongo_client = create_client()
+    automatic_collection = mongo_client[DB_NAME].get_collection(ENCRYPTED_COLLECTION)
+    cached_query = CachedEqualityQuery(DB_NAME, ENCRYPTED_COLLECTION, FIELD)
+
+    histograms = { "automatic": LatencyHistogram(), "cached explicit": LatencyHistogram() }
+    query_values = create_distribution(QUERY_DISTRIBUTION, VALUE_CARDINALITY)
+    for query_number in range(QUERIES):
+        search_int = query_values.next()
+        sides = [
+            ("automatic", lambda: automatic_collection.find({ FIELD: f"{search_int}" })),
+            ("cached explicit", lambda: cached_query.find(f"{search_int}")),
+        ]
+        if query_number % 2 == 1:
+            sides.reverse()
+        for side, find in sides:
+            start_time = now_ns()
+            for result in find():
+                assert(int(result[FIELD]) == search_int)
+            histograms[side].record_since(start_time)
+
+    for side, histogram in histograms.items():
+        report(side, histogram)
+        histogram.save(f"query_cache_{side.replace(' ', '_')}.json")
+    print(f"Payload cache: {cached_query.cache.hits} hits, {cached_query.cache.misses} misses "
+          f"({100 * cached_query.cache.hit_rate():.1f}% hit rate)")
+
+    cached_query.close()
+    mongo_client.close()
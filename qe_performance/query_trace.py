@@ -0,0 +1,200 @@
+"""
+Records the queries a run makes and replays them exactly, so that two driver
+or server versions can be compared on the same traffic.
+
+A trace is newline-delimited JSON. The first line is a header and every line
+after it is one operation:
+
+    {"format": "qe_performance trace", "version": 1, "db": ..., "collection": ..., "start_time": ...}
+    {"offset_ns": 1234567, "type": "find", "field": "encrypted_string", "value": "42",
+     "projection": {"__safeContent__": 0}, "batch_size": 100}
+
+offset_ns is when the operation started, from the start of the recording.
+type is "find" (read all of the results) or "count" ($match + $count on the
+server). Values are the plaintext; automatic encryption encrypts them again
+on replay. Finds also have the projection (null for everything) and the cursor
+batch size (0 for the server's default) they were sent with.
+
+reader.py records a trace when TRACE_FILE is set. To replay one:
+
+    python query_trace.py reader_trace.jsonl [original | max | <speed>]
+
+original keeps the recorded timing, max sends each query as soon as the last
+one has finished, and a number like 2 replays twice as fast as recorded. When
+paced, queries are sent on time whether or not earlier ones have finished,
+and latency is measured from when each should have started (see the open_loop
+mode in reader.py).
+"""
+
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from latency import LatencyHistogram, now_ns
+from utils import create_client, write_line_to_csv
+
+FORMAT = "qe_performance trace"
+VERSION = 1
+OPERATION_TYPES = ["find", "count"]
+REPLAY_MAX_IN_FLIGHT = 256  # threads available to run queries when paced
+
+
+class TraceRecorder:
+    """
+    Appends operations to a trace file from any thread, in the order they
+    start. record() only puts the operation on a list, and a background
+    thread encodes and writes them every flush_interval seconds, so recording
+    stays out of the measured latency (like sink.py).
+    """
+
+    def __init__(self, filename, db_name, collection_name, flush_interval=1.0):
+        self.filename = filename
+        self.flush_interval = flush_interval
+        self.condition = threading.Condition()
+        self.pending = []
+        self.closed = False
+        self.start_ns = now_ns()
+        self.file = open(filename, "w")
+        header = { "format": FORMAT, "version": VERSION, "db": db_name,
+                   "collection": collection_name, "start_time": time.time() }
+        self.file.write(json.dumps(header) + "\n")
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+
+    def record(self, operation_type, field, value, projection=None, batch_size=0):
+        with self.condition:
+            operation = { "offset_ns": now_ns() - self.start_ns, "type": operation_type,
+                          "field": field, "value": value }
+            if operation_type == "find":
+                operation["projection"] = projection
+                operation["batch_size"] = batch_size
+            self.pending.append(operation)
+
+    def _flush_loop(self):
+        while True:
+            with self.condition:
+                if not self.closed:
+                    self.condition.wait(self.flush_interval)
+                operations, self.pending = self.pending, []
+                closed = self.closed
+            if operations:
+                self.file.write("".join(json.dumps(operation) + "\n" for operation in operations))
+            if closed:
+                break
+        self.file.close()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.flusher.join()
+
+
+def read_trace(filename):
+    """
+    Returns (header, operations) for a trace file.
+    """
+
+    with open(filename) as file:
+        header = json.loads(file.readline())
+        if header.get("format") != FORMAT or header.get("version") != VERSION:
+            raise Exception(f"{filename} is not a version {VERSION} trace.")
+        operations = [json.loads(line) for line in file if line.strip()]
+    for operation in operations:
+        if operation["type"] not in OPERATION_TYPES:
+            raise Exception(f"Unknown operation type in {filename}: {operation['type']}")
+    return header, operations
+
+
+def run_operation(collection, operation):
+    # returns how many documents matched
+    if operation["type"] == "count":
+        results = list(collection.aggregate([
+            { "$match": { operation["field"]: operation["value"] } },
+            { "$count": "count" },
+        ]))
+        return results[0]["count"] if results else 0
+    return len(list(collection.find({ operation["field"]: operation["value"] }, operation.get("projection"),
+        batch_size=operation.get("batch_size", 0))))
+
+
+def replay_max(collection, operations):
+    histogram = LatencyHistogram()
+    for operation in operations:
+        start_time = now_ns()
+        run_operation(collection, operation)
+        histogram.record_since(start_time)
+    return { "latency": histogram, "service": histogram, "errors": 0 }
+
+
+def replay_paced(collection, operations, speed):
+    replay = { "latency": LatencyHistogram(), "service": LatencyHistogram(),
+               "errors": 0, "lock": threading.Lock() }
+
+    def timed_operation(operation, intended_start):
+        actual_start = now_ns()
+        try:
+            run_operation(collection, operation)
+            error = False
+        except Exception:
+            error = True
+        end = now_ns()
+        with replay["lock"]:
+            replay["latency"].record(end - intended_start)  # includes time queued
+            replay["service"].record(end - actual_start)
+            replay["errors"] += error
+
+    executor = ThreadPoolExecutor(max_workers=REPLAY_MAX_IN_FLIGHT)
+    futures = []
+    start_time = now_ns()
+    for operation in operations:
+        intended_start = start_time + int(operation["offset_ns"] / speed)
+        delay = intended_start - now_ns()
+        if delay > 0:
+            time.sleep(delay / 1e9)
+        futures.append(executor.submit(timed_operation, operation, intended_start))
+    wait(futures)
+    executor.shutdown()
+    return replay
+
+
+def replay(filename, pace="original"):
+    """
+    Replays a trace against the collection it was recorded on. pace is
+    "original", "max" or a speed multiplier.
+    """
+
+    header, operations = read_trace(filename)
+    mongo_client = create_client()
+    collection = mongo_client[header["db"]].get_collection(header["collection"])
+
+    print(f"Replaying {len(operations)} operations from {filename} at " +
+          (f"{pace} pace..." if pace in ["original", "max"] else f"{pace}x speed..."))
+    start_time = now_ns()
+    if pace == "max":
+        result = replay_max(collection, operations)
+    else:
+        result = replay_paced(collection, operations, 1.0 if pace == "original" else float(pace))
+    elapsed = (now_ns() - start_time) / 1e9
+    mongo_client.close()
+
+    achieved = len(operations) / elapsed
+    print(f"{len(operations)} operations in {elapsed:.1f} s ({achieved:.1f} ops/s), {result['errors']} errors")
+    result["latency"].print_summary("  latency from intended start" if pace != "max" else "  latency")
+    if pace != "max":
+        result["service"].print_summary("  service time")
+    result["latency"].save(f"replay_{pace}_histogram.json")
+
+    summary = result["latency"].summary_ms()
+    # trace, pace, operations, errors, elapsed (s), ops/s, p50, p90, p99, p99.9, max (ms)
+    write_line_to_csv("replay_output.csv", [filename, pace, len(operations), result["errors"], elapsed,
+        achieved, summary["p50"], summary["p90"], summary["p99"], summary["p99.9"], summary["max"]])
+    return result
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in [2, 3]:
+        print("usage: python query_trace.py <trace.jsonl> [original | max | <speed>]")
+        sys.exit(1)
+    replay(sys.argv[1], sys.argv[2] if len(sys.argv) == 3 else "original")
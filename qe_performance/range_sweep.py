@@ -0,0 +1,206 @@
+"""
+A batch harness for QE range index settings, using the same three fields as
+python-client/range_qe.py (secret_int, secret_long and secret_decimal).
+
+For every combination of SPARSITIES, TRIM_FACTORS, BOUNDED and (for bounded
+decimals) DECIMAL_PRECISIONS, this creates a fresh encrypted collection, loads
+DOCUMENTS documents, runs range finds of several widths on each field and
+measures how big the metadata (state) collections got. Everything ends up in
+one table, printed and written to range_sweep_output.csv.
+
+Range widths are fractions of each field's domain, so 0.01 means a query
+covering 1% of the values between the field's min and max.
+
+A trimFactor has to be smaller than the number of bits in the field's domain,
+so small domains (like a decimal with precision 2) get theirs lowered to fit.
+The table shows the trimFactor that was asked for.
+"""
+
+import itertools
+import random
+from decimal import Decimal, ROUND_DOWN, ROUND_UP
+from bson import Decimal128, Int64
+from docgen import DocumentGenerator
+from sweeps import recreate_encrypted_collection, timed_inserts, timed_finds, total_storage, print_table, write_table_csv
+from utils import create_client, create_plain_client, DB_NAME
+
+SPARSITIES = [1, 2, 4]
+TRIM_FACTORS = [0, 6]
+BOUNDED = [True, False]  # with min/max, or over the whole type
+DECIMAL_PRECISIONS = [2, 8]  # only for bounded; unbounded decimals have no precision
+
+DOCUMENTS = 10000
+ITEMS_TO_CREATE = 100  # per insert_many
+RANGE_WIDTHS = [0.001, 0.01, 0.1, 0.5]
+QUERIES_PER_WIDTH = 50
+SEED = 0
+
+# same domains as range_qe.py
+SECRET_INT_MIN = 1
+SECRET_INT_MAX = 1000
+
+SECRET_LONG_MIN = 474836472147483600
+SECRET_LONG_MAX = 474836472147483700
+
+SECRET_DECIMAL_MIN = Decimal("3.00000000")
+SECRET_DECIMAL_MAX = Decimal("3.14159265")
+UNBOUNDED_DECIMAL_PLACES = 8  # how many places the documents get without a precision
+
+FIELDS = ["secret_int", "secret_long", "secret_decimal"]
+
+
+def sweep_points():
+    for sparsity, trim_factor, bounded in itertools.product(SPARSITIES, TRIM_FACTORS, BOUNDED):
+        for precision in (DECIMAL_PRECISIONS if bounded else [None]):
+            yield { "sparsity": sparsity, "trimFactor": trim_factor, "bounded": bounded, "precision": precision }
+
+
+def domain_bits(field, point):
+    if not point["bounded"]:
+        return { "secret_int": 32, "secret_long": 64, "secret_decimal": 128 }[field]
+    if field == "secret_int":
+        return (SECRET_INT_MAX - SECRET_INT_MIN).bit_length()
+    elif field == "secret_long":
+        return (SECRET_LONG_MAX - SECRET_LONG_MIN).bit_length()
+    minimum, maximum = decimal_bounds(point)
+    return int((maximum - minimum) * 10**point["precision"]).bit_length()
+
+
+def range_query(field, point, minimum, maximum):
+    query = {
+        "queryType": "range",
+        "sparsity": Int64(point["sparsity"]),
+        "trimFactor": min(point["trimFactor"], domain_bits(field, point) - 1),
+    }
+    if point["bounded"]:
+        query["min"] = minimum
+        query["max"] = maximum
+        if field == "secret_decimal":
+            query["precision"] = point["precision"]
+    return [query]
+
+
+def encrypted_fields_map(point):
+    return {
+        "fields": [
+            {
+                "path": "secret_int",
+                "bsonType": "int",
+                "queries": range_query("secret_int", point, SECRET_INT_MIN, SECRET_INT_MAX),
+            },
+            {
+                "path": "secret_long",
+                "bsonType": "long",
+                "queries": range_query("secret_long", point, Int64(SECRET_LONG_MIN), Int64(SECRET_LONG_MAX)),
+            },
+            {
+                "path": "secret_decimal",
+                "bsonType": "decimal",  # decimal128
+                "queries": range_query("secret_decimal", point,
+                    *[Decimal128(bound) for bound in decimal_bounds(point)]),
+            },
+        ]
+    }
+
+
+#
+# Documents and queries
+#
+
+def decimal_places(point):
+    return point["precision"] if point["bounded"] else UNBOUNDED_DECIMAL_PLACES
+
+
+def decimal_bounds(point):
+    # min and max rounded inwards to the precision, since the range index needs them to fit it
+    step = Decimal(1).scaleb(-decimal_places(point))
+    return (SECRET_DECIMAL_MIN.quantize(step, rounding=ROUND_UP),
+            SECRET_DECIMAL_MAX.quantize(step, rounding=ROUND_DOWN))
+
+
+def random_decimal(rng, point, low=None, high=None):
+    minimum, maximum = decimal_bounds(point)
+    low = minimum if low is None else low
+    high = maximum if high is None else high
+    step = Decimal(1).scaleb(-decimal_places(point))
+    steps = int((high - low) / step)
+    return low + step * rng.randint(0, steps)
+
+
+def generate_batches(point):
+    rng = random.Random(SEED)
+    generator = DocumentGenerator(seed=SEED)
+    for batch in generator.batches(ITEMS_TO_CREATE, DOCUMENTS):
+        for document in batch:
+            del document["encrypted_string"]  # only the range fields are encrypted here
+            document["secret_int"] = rng.randint(SECRET_INT_MIN, SECRET_INT_MAX)
+            document["secret_long"] = Int64(rng.randint(SECRET_LONG_MIN, SECRET_LONG_MAX))
+            document["secret_decimal"] = Decimal128(random_decimal(rng, point))
+        yield batch
+
+
+def range_filters(field, point, width, rng):
+    for i in range(QUERIES_PER_WIDTH):
+        if field == "secret_int":
+            span = int((SECRET_INT_MAX - SECRET_INT_MIN) * width)
+            low = rng.randint(SECRET_INT_MIN, SECRET_INT_MAX - span)
+            high = low + span
+        elif field == "secret_long":
+            span = int((SECRET_LONG_MAX - SECRET_LONG_MIN) * width)
+            low = Int64(rng.randint(SECRET_LONG_MIN, SECRET_LONG_MAX - span))
+            high = Int64(low + span)
+        else:
+            minimum, maximum = decimal_bounds(point)
+            span = ((maximum - minimum) * Decimal(width)).quantize(
+                Decimal(1).scaleb(-decimal_places(point)), rounding=ROUND_DOWN)
+            low = random_decimal(rng, point, high=maximum - span)
+            high = Decimal128(low + span)
+            low = Decimal128(low)
+        yield { field: { "$gte": low, "$lte": high } }
+
+
+#
+# The sweep
+#
+
+def columns():
+    names = ["sparsity", "trimFactor", "bounded", "precision", "insert p50 ms", "insert p99 ms"]
+    for field, width in itertools.product(FIELDS, RANGE_WIDTHS):
+        names.append(f"{field} {width} p50 ms")
+    return names + ["state docs", "state MB"]
+
+
+def run_point(mongo_client, plain_client, number, point):
+    collection_name = f"range_{number}"
+    print(f"Range point {number}: {point}...")
+    collection = recreate_encrypted_collection(mongo_client, collection_name, encrypted_fields_map(point))
+
+    inserts, _ = timed_inserts(collection, generate_batches(point))
+    insert_summary = inserts.summary_ms()
+    row = [point["sparsity"], point["trimFactor"], point["bounded"], point["precision"],
+        insert_summary["p50"], insert_summary["p99"]]
+
+    rng = random.Random(SEED)
+    projection = { "__safeContent__": 0 }
+    for field, width in itertools.product(FIELDS, RANGE_WIDTHS):
+        finds = timed_finds(collection, range_filters(field, point, width, rng), projection=projection)
+        row.append(finds.summary_ms()["p50"])
+
+    storage = total_storage(plain_client, collection_name)
+    row += [storage["stateCount"], storage["stateSize"] / 2**20]
+    mongo_client[DB_NAME].drop_collection(collection_name)
+    return row
+
+
+if __name__ == "__main__":
+    mongo_client = create_client()
+    plain_client = create_plain_client()
+
+    rows = [run_point(mongo_client, plain_client, number, point) for number, point in enumerate(sweep_points())]
+
+    print()
+    print_table(columns(), rows)
+    write_table_csv("range_sweep_output.csv", columns(), rows)
+
+    plain_client.close()
+    mongo_client.close()
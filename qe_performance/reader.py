@@ -1,40 +1,555 @@
+"""
+Reads back what writer.py inserted, using encrypted equality queries.
+
+There are six modes:
+
+  * sequential - one query at a time, forever (well, ITERATIONS times)
+  * threads    - a closed loop of N threads sharing one MongoClient
+  * asyncio    - a closed loop of N coroutines sharing one AsyncMongoClient
+  * phases     - like sequential, but splits each find into phases (see phases.py)
+  * open_loop  - queries arrive at a target rate whether or not the last ones
+                 have finished, stepping the rate up through OPEN_LOOP_RATES
+  * tuning     - sequential queries for every combination of TUNING_PROJECTIONS
+                 and TUNING_BATCH_SIZES, plus a count-only aggregation, to see
+                 how much of the latency is result transfer and decryption
+
+Set TRACE_FILE to record every query for exact replay later with
+query_trace.py (all modes but phases).
+
+Set METRICS_PORT to watch a long run live, see metrics.py.
+
+In every mode, SERVER_STATS reports what changed on the server over the run
+(see server_stats.py).
+
+Set SAMPLE_RESOURCES_SECONDS to get the CPU time per query in sequential mode
+(see resources.py).
+
+The first queries are a warm-up that doesn't count (see stages.py), lasting
+at least WARMUP_QUERIES and then until latency settles. In sequential mode
+that's the start of the run. The threads, asyncio, open_loop and tuning modes
+warm up with one query at a time before their first level, rate or row, so
+the cold start doesn't end up in it (a bigger connection pool still has to
+grow during the first few levels).
+
+The concurrent modes step through CONCURRENCY_LEVELS and write one line per
+level to a CSV, so you can plot throughput vs. concurrency and see where the
+encrypted read path saturates.
+
+The closed-loop modes can't show queueing delay, because a slow server also
+slows down the arrival of new queries (coordinated omission). In open_loop
+mode latency is measured from when each query was supposed to start, so time
+spent waiting behind other queries counts.
+"""
+
+import asyncio
 import random
+import threading
 import time
-from utils import create_client, DB_NAME, ENCRYPTED_COLLECTION, write_line_to_csv
+from concurrent.futures import ThreadPoolExecutor, wait
+from sink import ResultSink
+from distributions import create_distribution
+from phases import PhaseInstrumentation, PhaseRecorder
+from resources import ResourceSampler, print_totals
+from server_stats import ServerStatsRecorder
+from query_trace import TraceRecorder
+from metrics import start_metrics_server
+from stages import StageTracker, WARMUP, STEADY, DONE
+from latency import LatencyHistogram, now_ns, NANOSECONDS_PER_MILLISECOND
+from sweeps import print_table, write_table_csv
+from utils import create_client, create_async_client, create_plain_client, DB_NAME, ENCRYPTED_COLLECTION, write_line_to_csv
 from pprint import pprint
 
-mongo_client = create_client()
+MODE = "sequential"  # "sequential", "threads", "asyncio", "phases", "open_loop" or "tuning"
+
+ITERATIONS = 10**9  # only used in sequential and phases modes
+MAX_SECRET_NUMBER = 199 # based on what's being inserted
+
+# which values to search for, see distributions.py
+QUERY_DISTRIBUTION = "uniform"  # "uniform", "zipfian", "hotspot" or "sequential"
+ZIPFIAN_EXPONENT = 1.0
+HOT_FRACTION = 0.1  # for hotspot, the share of values that are hot...
+HOT_PROBABILITY = 0.9  # ...and the share of queries that go to them
+
+CONCURRENCY_LEVELS = [1, 2, 4, 8, 16, 32, 64]  # workers per step
+SECONDS_PER_LEVEL = 30
+
+OPEN_LOOP_RATES = [25, 50, 100, 200, 400, 800, 1600]  # queries/s per step
+OPEN_LOOP_SECONDS_PER_RATE = 30
+OPEN_LOOP_ARRIVALS = "poisson"  # "poisson" or "constant" inter-arrival times
+OPEN_LOOP_MAX_IN_FLIGHT = 256  # threads available to run queries
+KNEE_P99_FACTOR = 5  # p99 this many times the first step's p99 is past the knee
+
+# how queries fetch their results, in every mode but phases
+PROJECTION = None  # e.g. { "__safeContent__": 0 } or { "encrypted_string": 1, "_id": 0 }
+BATCH_SIZE = 0  # cursor batch size, 0 for the server's default
+COUNT_ONLY = False  # count with $match + $count on the server instead of fetching documents
+
+TUNING_PROJECTIONS = {
+    "everything": None,
+    "no __safeContent__": { "__safeContent__": 0 },
+    "encrypted_string": { "encrypted_string": 1, "_id": 0 },
+    "_id only": { "_id": 1 },
+}
+TUNING_BATCH_SIZES = [0, 10, 100, 1000]
+TUNING_QUERIES = 1000  # per combination
+
+SUMMARY_EVERY = 1000  # queries between latency summaries in sequential and phases modes
+SAMPLE_RESOURCES_SECONDS = 0  # sample CPU and memory this often in sequential mode, 0 for never
+SERVER_STATS = True  # snapshot serverStatus, collStats and dbStats before and after
+SERVER_STATS_SECONDS = 0  # and this often in between, 0 for never
+TRACE_FILE = None  # e.g. "reader_trace.jsonl" to record the queries, see query_trace.py
+METRICS_PORT = 0  # e.g. 9464 to serve live OpenMetrics at /metrics (all modes but phases)
+
+# warm-up in every mode but phases, steady state and drain in sequential mode, see stages.py
+WARMUP_SECONDS = 0
+WARMUP_QUERIES = 100
+WAIT_FOR_STABLE = True  # keep warming up until find latency settles down...
+STABLE_WINDOW = 100  # ...meaning the median of the last few windows of this many queries...
+STABLE_TOLERANCE = 0.1  # ...are within 10% of each other
+STEADY_SECONDS = 0  # 0 to keep measuring until ITERATIONS
+DRAIN_SECONDS = 0  # keep querying (unmeasured) this long after the steady state
+
+
+query_values = create_distribution(QUERY_DISTRIBUTION, MAX_SECRET_NUMBER + 1,
+    ZIPFIAN_EXPONENT, HOT_FRACTION, HOT_PROBABILITY)
+
+trace_recorder = TraceRecorder(TRACE_FILE, DB_NAME, ENCRYPTED_COLLECTION) if TRACE_FILE else None
+metrics = start_metrics_server(METRICS_PORT) if METRICS_PORT else None
+
+
+def count_pipeline(search_int):
+    return [
+        { "$match": { "encrypted_string": f"{search_int}" } },
+        { "$count": "count" },
+    ]
+
+
+def run_query(collection, search_int, projection=PROJECTION, batch_size=BATCH_SIZE, count_only=COUNT_ONLY):
+    """
+    Runs one encrypted equality query and returns how many documents matched.
+    """
+
+    operation = "count" if count_only else "find"
+    if trace_recorder is not None:
+        trace_recorder.record(operation, "encrypted_string", f"{search_int}", projection, batch_size)
+    if metrics is None:
+        return fetch_results(collection, search_int, projection, batch_size, count_only)
+
+    metrics.start(operation)
+    start_time = now_ns()
+    error = True
+    try:
+        count = fetch_results(collection, search_int, projection, batch_size, count_only)
+        error = False
+        return count
+    finally:
+        metrics.finish(operation, now_ns() - start_time, error)
+
+
+def fetch_results(collection, search_int, projection, batch_size, count_only):
+    if count_only:
+        results = list(collection.aggregate(count_pipeline(search_int)))
+        return results[0]["count"] if results else 0
+
+    count = 0
+    for result in collection.find({ "encrypted_string": f"{search_int}" }, projection, batch_size=batch_size):
+        if "encrypted_string" in result:  # the projection might leave it out
+            assert(int(result["encrypted_string"]) == search_int)
+        count += 1
+    return count
+
+
+async def run_async_query(collection, search_int):
+    # the same as run_query, for the asyncio client
+    operation = "count" if COUNT_ONLY else "find"
+    if trace_recorder is not None:
+        trace_recorder.record(operation, "encrypted_string", f"{search_int}", PROJECTION, BATCH_SIZE)
+    if metrics is None:
+        return await fetch_async_results(collection, search_int)
+
+    metrics.start(operation)
+    start_time = now_ns()
+    error = True
+    try:
+        count = await fetch_async_results(collection, search_int)
+        error = False
+        return count
+    finally:
+        metrics.finish(operation, now_ns() - start_time, error)
+
+
+async def fetch_async_results(collection, search_int):
+    if COUNT_ONLY:
+        results = await (await collection.aggregate(count_pipeline(search_int))).to_list()
+        return results[0]["count"] if results else 0
+
+    count = 0
+    async for result in collection.find({ "encrypted_string": f"{search_int}" }, PROJECTION, batch_size=BATCH_SIZE):
+        if "encrypted_string" in result:
+            assert(int(result["encrypted_string"]) == search_int)
+        count += 1
+    return count
+
+
+def new_warmup_tracker():
+    return StageTracker("Reader", WARMUP_SECONDS, WARMUP_QUERIES, WAIT_FOR_STABLE,
+        STABLE_WINDOW, STABLE_TOLERANCE)
+
+
+def warm_up(collection):
+    # before the first level, rate or row of the other modes
+    stages = new_warmup_tracker()
+    while stages.stage == WARMUP:
+        start_time = now_ns()
+        run_query(collection, query_values.next())
+        stages.record(now_ns() - start_time)
+
+
+async def warm_up_async(collection):
+    stages = new_warmup_tracker()
+    while stages.stage == WARMUP:
+        start_time = now_ns()
+        await run_async_query(collection, query_values.next())
+        stages.record(now_ns() - start_time)
+
 
 #
 # Perform repeated queries against the encrypted database
 #
 
-ITERATIONS = 10**9
-MAX_SECRET_NUMBER = 199 # based on what's being inserted
+def run_sequential():
+    mongo_client = create_client()
+    histogram = LatencyHistogram()
+    results_sink = ResultSink("reader_output.bin", ["iteration", "results", "elapsed_ms"], "qqd")
+    if SAMPLE_RESOURCES_SECONDS:
+        resource_sampler = ResourceSampler("reader_resources.csv", SAMPLE_RESOURCES_SECONDS)
+    stages = StageTracker("Reader", WARMUP_SECONDS, WARMUP_QUERIES, WAIT_FOR_STABLE,
+        STABLE_WINDOW, STABLE_TOLERANCE, steady_seconds=STEADY_SECONDS, drain_seconds=DRAIN_SECONDS)
 
-for i in range(ITERATIONS):
-    print(f"Performing query number {i + 1} of {ITERATIONS}...")
+    for i in range(ITERATIONS):
+        if stages.stage == DONE:
+            break
 
-    #
-    # SWITCH TO AN ENCRYPTED QUERY!
-    #
+        print(f"Performing query number {i + 1} of {ITERATIONS}...")
 
-    search_int = random.randint(0, MAX_SECRET_NUMBER)
-    super_secret_search_string = f"{search_int}"
+        #
+        # SWITCH TO AN ENCRYPTED QUERY!
+        #
 
-    start_time = time.time()
-    results = mongo_client[DB_NAME].get_collection(ENCRYPTED_COLLECTION).find({
-        "encrypted_string": super_secret_search_string
-    })
-    count = 0
-    for result in results:
-        assert(int(result["encrypted_string"]) == search_int)
-        count += 1
-    end_time = time.time()
+        search_int = query_values.next()
+
+        start_time = now_ns()
+        count = run_query(mongo_client[DB_NAME].get_collection(ENCRYPTED_COLLECTION), search_int)
+        elapsed_ns = now_ns() - start_time
+        elapsed = elapsed_ns / NANOSECONDS_PER_MILLISECOND
+
+        print(f"Query and iteration over {count} results took {elapsed:.2f} ms.")
+        if SAMPLE_RESOURCES_SECONDS:
+            resource_sampler.operations.add()
+
+        if stages.record(elapsed_ns) != STEADY:
+            continue  # warm-up and drain don't count
+        histogram.record(elapsed_ns)
+
+        results_sink.write((i + 1, count, elapsed))  # save the perf data (python sink.py to get a CSV)
+
+        if (i + 1) % SUMMARY_EVERY == 0:
+            histogram.print_summary("Encrypted find")
+            histogram.save("reader_histogram.json")
+
+    stages.finish()
+    if SAMPLE_RESOURCES_SECONDS:
+        print_totals("Encrypted find resources", resource_sampler.stop())
+    histogram.print_summary("Encrypted find")
+    histogram.save("reader_histogram.json")
+    results_sink.close()
+    mongo_client.close()
+
+
+#
+# Where does the time go? Each find runs through automatic encryption and then
+# again through explicit encryption so that the client work can be split up.
+#
+
+def run_phases():
+    instrumentation = PhaseInstrumentation(DB_NAME, ENCRYPTED_COLLECTION, "encrypted_string")
+    recorder = PhaseRecorder()
+
+    for i in range(ITERATIONS):
+        search_int = query_values.next()
+        results, phases = instrumentation.measure_find(f"{search_int}")
+        for result in results:
+            assert(int(result["encrypted_string"]) == search_int)
+        recorder.record(phases)
+
+        if (i + 1) % SUMMARY_EVERY == 0:
+            recorder.print_summary(f"After {i + 1} encrypted finds")
+            recorder.save("reader_phases.json")
+
+    recorder.print_summary("Encrypted find")
+    recorder.save("reader_phases.json")
+    instrumentation.close()
+
+
+#
+# Closed-loop concurrent readers. Every worker issues its next query as soon as
+# the previous one comes back, so the offered load grows with the worker count.
+#
+
+def new_worker_stats():
+    return { "latency": LatencyHistogram(), "results": 0, "errors": 0, "last_error": None }
+
+
+def record_error(stats, error):
+    # keep going, so one bad query doesn't quietly take a worker out of the level
+    stats["errors"] += 1
+    stats["last_error"] = error
+
+
+def thread_worker(collection, stop_event, stats):
+    while not stop_event.is_set():
+        search_int = query_values.next()
+        start_time = now_ns()
+        try:
+            count = run_query(collection, search_int)
+        except Exception as error:
+            record_error(stats, error)
+            continue
+        stats["latency"].record_since(start_time)
+        stats["results"] += count
+
+
+def run_threads_level(collection, workers):
+    stop_event = threading.Event()
+    all_stats = [new_worker_stats() for _ in range(workers)]
+    threads = [
+        threading.Thread(target=thread_worker, args=(collection, stop_event, stats))
+        for stats in all_stats
+    ]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(SECONDS_PER_LEVEL)
+    stop_event.set()
+    for thread in threads:
+        thread.join()
+    return all_stats, time.perf_counter() - start_time
+
+
+async def async_worker(collection, deadline, stats):
+    while time.perf_counter() < deadline:
+        search_int = query_values.next()
+        start_time = now_ns()
+        try:
+            count = await run_async_query(collection, search_int)
+        except Exception as error:
+            record_error(stats, error)
+            continue
+        stats["latency"].record_since(start_time)
+        stats["results"] += count
+
+
+async def run_asyncio_level(collection, workers):
+    all_stats = [new_worker_stats() for _ in range(workers)]
+    start_time = time.perf_counter()
+    deadline = start_time + SECONDS_PER_LEVEL
+    await asyncio.gather(*[async_worker(collection, deadline, stats) for stats in all_stats])
+    return all_stats, time.perf_counter() - start_time
+
+
+def report_level(mode, workers, all_stats, elapsed):
+    combined = LatencyHistogram()
+    for stats in all_stats:
+        combined.merge(stats["latency"])
+    combined.save(f"reader_histogram_{mode}_{workers}.json")
+
+    qps = combined.count / elapsed
+    errors = sum(stats["errors"] for stats in all_stats)
+    print(f"{workers} {mode} workers: {combined.count} queries in {elapsed:.1f} s, {qps:.1f} queries/s, "
+          f"{errors} errors")
+    combined.print_summary("  all workers")
+
+    for worker, stats in enumerate(all_stats):
+        stats["latency"].print_summary(f"  worker {worker}")
+        if stats["errors"]:
+            print(f"  worker {worker}: {stats['errors']} errors, the last was {stats['last_error']!r}")
+        summary = stats["latency"].summary_ms()
+        # mode, workers, worker number, queries, results, mean, p50, p99, max (ms), errors
+        write_line_to_csv("reader_concurrency_workers.csv", [mode, workers, worker,
+            summary["count"], stats["results"], summary["mean"], summary["p50"],
+            summary["p99"], summary["max"], stats["errors"]])
+
+    summary = combined.summary_ms()
+    # mode, workers, queries, elapsed (s), queries/s, mean, p50, p90, p99, p99.9, max (ms), errors
+    write_line_to_csv("reader_concurrency_output.csv", [mode, workers, summary["count"],
+        elapsed, qps, summary["mean"], summary["p50"], summary["p90"], summary["p99"],
+        summary["p99.9"], summary["max"], errors])
+
+
+def run_threads():
+    mongo_client = create_client()  # one pool shared by all threads
+    collection = mongo_client[DB_NAME].get_collection(ENCRYPTED_COLLECTION)
+    warm_up(collection)
+    for workers in CONCURRENCY_LEVELS:
+        all_stats, elapsed = run_threads_level(collection, workers)
+        report_level("threads", workers, all_stats, elapsed)
+    mongo_client.close()
+
+
+async def run_asyncio():
+    mongo_client = create_async_client()  # one pool shared by all coroutines
+    collection = mongo_client[DB_NAME].get_collection(ENCRYPTED_COLLECTION)
+    await warm_up_async(collection)
+    for workers in CONCURRENCY_LEVELS:
+        all_stats, elapsed = await run_asyncio_level(collection, workers)
+        report_level("asyncio", workers, all_stats, elapsed)
+    await mongo_client.close()
+
+
+#
+# Open-loop readers. A scheduler hands out queries at the target rate and a
+# pool of threads runs them.
+#
+
+def next_interval_ns(rate):
+    if OPEN_LOOP_ARRIVALS == "poisson":
+        return int(random.expovariate(rate) * 1e9)
+    elif OPEN_LOOP_ARRIVALS == "constant":
+        return int(1e9 / rate)
+    raise Exception(f"Unknown OPEN_LOOP_ARRIVALS: {OPEN_LOOP_ARRIVALS}")
+
+
+def open_loop_query(collection, intended_start, step):
+    search_int = query_values.next()
+    actual_start = now_ns()
+    try:
+        run_query(collection, search_int)
+        error = False
+    except Exception:
+        error = True
+    end = now_ns()
+    with step["lock"]:
+        step["latency"].record(end - intended_start)  # includes time queued
+        step["service"].record(end - actual_start)
+        step["errors"] += error
+
+
+def run_open_loop_step(collection, executor, rate):
+    step = { "latency": LatencyHistogram(), "service": LatencyHistogram(),
+             "errors": 0, "lock": threading.Lock() }
+    futures = []
+    start_time = now_ns()
+    deadline = start_time + OPEN_LOOP_SECONDS_PER_RATE * 1_000_000_000
+    intended_start = start_time + next_interval_ns(rate)
+    while intended_start < deadline:
+        delay = intended_start - now_ns()
+        if delay > 0:
+            time.sleep(delay / 1e9)
+        # if we're behind we submit right away, but keep the intended time
+        futures.append(executor.submit(open_loop_query, collection, intended_start, step))
+        intended_start += next_interval_ns(rate)
+    wait(futures)
+    step["elapsed"] = (now_ns() - start_time) / 1e9
+    return step
+
+
+def run_open_loop():
+    mongo_client = create_client()
+    collection = mongo_client[DB_NAME].get_collection(ENCRYPTED_COLLECTION)
+    executor = ThreadPoolExecutor(max_workers=OPEN_LOOP_MAX_IN_FLIGHT)
+    first_p99 = None
+    knee = None
+
+    warm_up(collection)
+    for rate in OPEN_LOOP_RATES:
+        step = run_open_loop_step(collection, executor, rate)
+        achieved = step["latency"].count / step["elapsed"]
+        print(f"Target {rate} queries/s, achieved {achieved:.1f} queries/s, {step['errors']} errors")
+        step["latency"].print_summary("  latency from intended start")
+        step["service"].print_summary("  service time")
+        step["latency"].save(f"reader_open_loop_{rate}.json")
+
+        summary = step["latency"].summary_ms()
+        service = step["service"].summary_ms()
+        # target rate, achieved rate, queries, errors, p50, p90, p99, p99.9, max,
+        # service p50, service p99 (ms)
+        write_line_to_csv("reader_open_loop_output.csv", [rate, achieved, summary["count"],
+            step["errors"], summary["p50"], summary["p90"], summary["p99"], summary["p99.9"],
+            summary["max"], service["p50"], service["p99"]])
+
+        if first_p99 is None:
+            first_p99 = summary["p99"]
+        elif knee is None and summary["p99"] > KNEE_P99_FACTOR * first_p99:
+            knee = rate
+            print(f"p99 is past {KNEE_P99_FACTOR}x the first step at {rate} queries/s.")
+
+    if knee is None:
+        print("Latency stayed flat over all the rates. Try higher OPEN_LOOP_RATES.")
+    executor.shutdown()
+    mongo_client.close()
+
+
+#
+# How much of a query is fetching and decrypting results? The same queries with
+# less and less coming back, in different sized batches.
+#
+
+TUNING_COLUMNS = ["projection", "batch size", "queries/s", "p50 ms", "p90 ms", "p99 ms", "max ms"]
+
+
+def tuning_row(collection, projection_name, batch_size, projection=None, count_only=False):
+    histogram = LatencyHistogram()
+    overall_start_time = now_ns()
+    for i in range(TUNING_QUERIES):
+        start_time = now_ns()
+        run_query(collection, query_values.next(), projection, batch_size, count_only)
+        histogram.record_since(start_time)
+    elapsed = (now_ns() - overall_start_time) / 1e9
+    histogram.save(f"reader_tuning_{projection_name.replace(' ', '_')}_{batch_size}.json")
+    summary = histogram.summary_ms()
+    return [projection_name, batch_size, histogram.count / elapsed,
+        summary["p50"], summary["p90"], summary["p99"], summary["max"]]
+
+
+def run_tuning():
+    mongo_client = create_client()
+    collection = mongo_client[DB_NAME].get_collection(ENCRYPTED_COLLECTION)
+    rows = []
+    warm_up(collection)
+    for projection_name, projection in TUNING_PROJECTIONS.items():
+        for batch_size in TUNING_BATCH_SIZES:
+            print(f"Tuning: projection {projection_name}, batch size {batch_size}...")
+            rows.append(tuning_row(collection, projection_name, batch_size, projection))
+    print("Tuning: count only...")
+    rows.append(tuning_row(collection, "count only", 0, count_only=True))
+
+    print()
+    print_table(TUNING_COLUMNS, rows)
+    write_table_csv("reader_tuning_output.csv", TUNING_COLUMNS, rows)
+    mongo_client.close()
+
+
+if SERVER_STATS:
+    plain_client = create_plain_client()
+    server_stats = ServerStatsRecorder(plain_client, ENCRYPTED_COLLECTION, f"reader_{MODE}", SERVER_STATS_SECONDS)
 
-    elapsed = 100*(end_time - start_time)
-    print(f"Query and iteration over {count} results took {elapsed} ms.")
+if MODE == "sequential":
+    run_sequential()
+elif MODE == "threads":
+    run_threads()
+elif MODE == "asyncio":
+    asyncio.run(run_asyncio())
+elif MODE == "phases":
+    run_phases()
+elif MODE == "open_loop":
+    run_open_loop()
+elif MODE == "tuning":
+    run_tuning()
+else:
+    raise Exception(f"Unknown MODE: {MODE}")
 
-    PERF_FILE = "reader_output.csv"
-    # iteration number, results count, elapsed time (ms)
-    write_line_to_csv(PERF_FILE, [i + 1, count, elapsed])  # save the perf data
+if SERVER_STATS:
+    server_stats.stop()
+    plain_client.close()
+if trace_recorder is not None:
+    trace_recorder.close()
@@ -0,0 +1,220 @@
+"""
+What does an encrypted operation cost the client? ResourceSampler is a
+background thread that samples this process's CPU time (user and system), RSS,
+thread count and garbage collections every interval seconds, along with an
+OperationCounter that the workload adds to, and appends them to a CSV.
+
+    python resources.py
+
+runs the same inserts and queries against ENCRYPTED_COLLECTION and a
+plaintext twin (PLAINTEXT_COLLECTION), one after the other so each gets the
+process to itself, and reports CPU microseconds per inserted document and per
+query for both (also written to resources_output.csv). writer.py and reader.py
+sample themselves when SAMPLE_RESOURCES_SECONDS is set.
+
+Only the standard library is used. RSS and thread counts come from /proc where
+there is one; elsewhere (macOS) RSS is the peak and threads are only the
+Python ones, which leaves out libmongocrypt's.
+"""
+
+import gc
+import os
+import resource
+import sys
+import threading
+import time
+from sweeps import encrypted_and_plaintext, generate_workload
+from utils import create_client, create_plain_client, write_line_to_csv
+
+ITEMS_TO_CREATE = 200  # per insert_many
+INSERT_BATCHES = 500
+QUERIES = 10000
+VALUE_CARDINALITY = 200
+SAMPLE_SECONDS = 1
+SEED = 0
+
+PROC_STATUS = "/proc/self/status"
+
+
+class OperationCounter:
+    """
+    A thread-safe count of operations done so far.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, count=1):
+        with self.lock:
+            self.count += count
+
+
+class GarbageCollectionTimer:
+    """
+    Counts collections and adds up the time spent in them, using gc.callbacks.
+    """
+
+    def __init__(self):
+        self.collections = [0] * len(gc.get_count())
+        self.pause_ns = 0
+        self.start_ns = None
+        gc.callbacks.append(self._callback)
+
+    def _callback(self, phase, info):
+        if phase == "start":
+            self.start_ns = time.perf_counter_ns()
+        elif self.start_ns is not None:
+            self.pause_ns += time.perf_counter_ns() - self.start_ns
+            self.collections[info["generation"]] += 1
+            self.start_ns = None
+
+    def close(self):
+        gc.callbacks.remove(self._callback)
+
+
+def memory_and_threads():
+    # returns (RSS in bytes, thread count)
+    if os.path.exists(PROC_STATUS):
+        status = {}
+        with open(PROC_STATUS) as file:
+            for line in file:
+                key, _, value = line.partition(":")
+                status[key] = value.split()
+        return int(status["VmRSS"][0]) * 1024, int(status["Threads"][0])
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak *= 1024  # kilobytes everywhere but macOS
+    return peak, threading.active_count()
+
+
+class ResourceSampler:
+    """
+    A background thread that samples this process every interval seconds and
+    appends a line to a CSV. Pass the OperationCounter that the workload adds
+    to, so CPU time can be put per operation.
+    """
+
+    COLUMNS = ["elapsed", "operations", "cpu_user", "cpu_system", "rss_bytes", "threads",
+               "gc_gen0", "gc_gen1", "gc_gen2", "gc_ms"]
+
+    def __init__(self, filename, interval, operations=None):
+        self.filename = filename
+        self.interval = interval
+        self.operations = operations if operations is not None else OperationCounter()
+        self.gc_timer = GarbageCollectionTimer()
+        self.stop_event = threading.Event()
+        self.start_time = time.time()
+        self.rss_peak = 0
+        write_line_to_csv(self.filename, self.COLUMNS)
+        self.first = self.sample()
+        self.last = self.first
+        self.thread = threading.Thread(target=self._sample_loop, daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        times = os.times()
+        rss, threads = memory_and_threads()
+        sample = {
+            "elapsed": time.time() - self.start_time,
+            "operations": self.operations.count,
+            "cpu_user": times.user,
+            "cpu_system": times.system,
+            "rss_bytes": rss,
+            "threads": threads,
+            "gc_gen0": self.gc_timer.collections[0],
+            "gc_gen1": self.gc_timer.collections[1],
+            "gc_gen2": self.gc_timer.collections[2],
+            "gc_ms": self.gc_timer.pause_ns / 1e6,
+        }
+        self.rss_peak = max(self.rss_peak, rss)
+        write_line_to_csv(self.filename, [sample[column] for column in self.COLUMNS])
+        return sample
+
+    def _sample_loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.last = self.sample()
+
+    def stop(self):
+        """
+        Stops sampling and returns totals over the whole run, including CPU
+        microseconds per operation.
+        """
+
+        self.stop_event.set()
+        self.thread.join()
+        self.last = self.sample()
+        self.gc_timer.close()
+
+        operations = self.last["operations"] - self.first["operations"]
+        cpu_user = self.last["cpu_user"] - self.first["cpu_user"]
+        cpu_system = self.last["cpu_system"] - self.first["cpu_system"]
+        return {
+            "operations": operations,
+            "seconds": self.last["elapsed"],
+            "cpu_user": cpu_user,
+            "cpu_system": cpu_system,
+            "cpu_us_per_op": 1e6 * (cpu_user + cpu_system) / operations if operations else 0,
+            "rss_peak": self.rss_peak,
+            "gc_collections": sum(self.last[f"gc_gen{generation}"] for generation in range(3)),
+            "gc_ms": self.last["gc_ms"],
+        }
+
+
+def print_totals(name, totals):
+    print(f"{name}: {totals['operations']} ops in {totals['seconds']:.1f} s, "
+          f"CPU {totals['cpu_user']:.2f} s user + {totals['cpu_system']:.2f} s system, "
+          f"{totals['cpu_us_per_op']:.1f} CPU-us/op, RSS {totals['rss_peak'] / 2**20:.1f} MB, "
+          f"{totals['gc_collections']} GCs taking {totals['gc_ms']:.1f} ms")
+
+
+#
+# Encrypted vs. plaintext
+#
+
+def measure(side, operation, workload):
+    operations = OperationCounter()
+    sampler = ResourceSampler(f"resources_{side}_{operation}_samples.csv", SAMPLE_SECONDS, operations)
+    workload(operations)
+    totals = sampler.stop()
+    print_totals(f"{side} {operation}", totals)
+    # side, operation, operations, seconds, CPU user (s), CPU system (s),
+    # CPU-us per operation, peak RSS (bytes), GCs, GC time (ms)
+    write_line_to_csv("resources_output.csv", [side, operation, totals["operations"], totals["seconds"],
+        totals["cpu_user"], totals["cpu_system"], totals["cpu_us_per_op"], totals["rss_peak"],
+        totals["gc_collections"], totals["gc_ms"]])
+    return totals
+
+
+def measure_side(side, collection):
+    batches, filters = generate_workload(ITEMS_TO_CREATE, INSERT_BATCHES, QUERIES, VALUE_CARDINALITY, seed=SEED)
+
+    def inserts(operations):
+        for batch in batches:
+            collection.insert_many(batch)
+            operations.add(len(batch))
+
+    def queries(operations):
+        for filter in filters:
+            list(collection.find(filter))
+            operations.add()
+
+    return measure(side, "insert", inserts), measure(side, "query", queries)
+
+
+if __name__ == "__main__":
+    mongo_client = create_client()
+    plain_client = create_plain_client()
+
+    with encrypted_and_plaintext(mongo_client, plain_client) as (encrypted_collection, plaintext_collection):
+        encrypted = measure_side("encrypted", encrypted_collection)
+        plaintext = measure_side("plaintext", plaintext_collection)
+
+    print()
+    for operation, encrypted_totals, plaintext_totals in zip(["insert", "query"], encrypted, plaintext):
+        ratio = encrypted_totals["cpu_us_per_op"] / (plaintext_totals["cpu_us_per_op"] or 1)
+        print(f"CPU-us per {operation}: {encrypted_totals['cpu_us_per_op']:.1f} encrypted, "
+              f"{plaintext_totals['cpu_us_per_op']:.1f} plaintext ({ratio:.1f}x)")
+
+    plain_client.close()
+    mongo_client.close()
@@ -0,0 +1,214 @@
+"""
+Runs a workload described in a TOML scenario file, so that we can reproduce a
+production mix without editing the constants in writer.py and reader.py.
+
+    python scenario.py scenarios/read_heavy.toml
+
+A scenario says what the documents look like (which fields, which of them are
+encrypted and queryable, how many distinct values they have), the read/write
+mix, the insert batch size, how many threads to run and for how long. See
+scenarios/read_heavy.toml for an example with every setting.
+
+The encrypted collection is created from the scenario's fields, so it has to
+not exist yet. Reads are encrypted equality finds on a random queryable field.
+"""
+
+import random
+import sys
+import threading
+import tomllib
+import numpy as np
+from distributions import create_distribution
+from docgen import build_vocabulary
+from latency import LatencyHistogram, now_ns
+from sink import ResultSink
+from utils import create_client, create_encrypted_collection, does_collection_exist, set_path, DB_NAME, write_line_to_csv
+
+
+SCENARIO_DEFAULTS = {
+    "name": "scenario",
+    "collection": "scenario_collection",
+    "duration_seconds": 60,
+    "concurrency": 1,
+    "read_ratio": 0.5,
+    "batch_size": 200,
+    "drop_when_done": True,
+}
+
+FIELD_DEFAULTS = {
+    "type": "string",  # "string", "int" or "text" (nonsense words)
+    "encrypted": False,
+    "queryable": False,  # equality queryable, only for encrypted fields
+    "cardinality": 200,  # distinct values, for string and int
+    "words": 1,  # for text
+    "distribution": "uniform",  # for inserted values, see distributions.py
+    "query_distribution": None,  # for searched values, defaults to distribution
+    "exponent": 1.0,  # zipfian
+    "hot_fraction": 0.1,  # hotspot
+    "hot_probability": 0.9,  # hotspot
+}
+
+BSON_TYPES = { "string": "string", "int": "int", "text": "string" }
+
+READ = 0
+WRITE = 1
+
+VOCABULARY_SIZE = 4096  # nonsense words per text field
+
+
+def load_scenario(filename):
+    with open(filename, "rb") as file:
+        data = tomllib.load(file)
+
+    unknown = set(data) - set(SCENARIO_DEFAULTS) - { "fields" }
+    if unknown:
+        raise Exception(f"Unknown scenario settings: {', '.join(sorted(unknown))}")
+
+    scenario = { **SCENARIO_DEFAULTS, **data }
+    scenario["fields"] = []
+    for field in data.get("fields", []):
+        unknown = set(field) - set(FIELD_DEFAULTS) - { "path" }
+        if unknown:
+            raise Exception(f"Unknown field settings: {', '.join(sorted(unknown))}")
+        field = { **FIELD_DEFAULTS, **field }
+        if field["type"] not in BSON_TYPES:
+            raise Exception(f"Unknown field type: {field['type']}")
+        if field["queryable"] and (not field["encrypted"] or field["type"] == "text"):
+            raise Exception(f"{field['path']} can't be queryable (only encrypted string and int fields can).")
+        if field["query_distribution"] is None:
+            field["query_distribution"] = field["distribution"]
+        if field["type"] == "text":
+            field["vocabulary"] = build_vocabulary(np.random.default_rng(), VOCABULARY_SIZE)
+        else:
+            field["values"] = create_field_distribution(field, field["distribution"])
+            field["query_values"] = create_field_distribution(field, field["query_distribution"])
+        scenario["fields"].append(field)
+
+    if scenario["read_ratio"] > 0 and not queryable_fields(scenario):
+        raise Exception("A scenario with reads needs at least one queryable field.")
+
+    return scenario
+
+
+def create_field_distribution(field, name):
+    return create_distribution(name, field["cardinality"],
+        field["exponent"], field["hot_fraction"], field["hot_probability"])
+
+
+def queryable_fields(scenario):
+    return [field for field in scenario["fields"] if field["queryable"]]
+
+
+def encrypted_fields_map(scenario):
+    fields = []
+    for field in scenario["fields"]:
+        if field["encrypted"]:
+            encrypted_field = { "path": field["path"], "bsonType": BSON_TYPES[field["type"]] }
+            if field["queryable"]:
+                encrypted_field["queries"] = [ { "queryType": "equality" } ]
+            fields.append(encrypted_field)
+    return { "fields": fields }
+
+
+#
+# Generating documents
+#
+
+def generate_value(field, query=False):
+    if field["type"] == "text":
+        return ' '.join(random.choices(field["vocabulary"], k=field["words"]))
+    value = field["query_values" if query else "values"].next()
+    return f"{value}" if field["type"] == "string" else value
+
+
+def generate_document(scenario):
+    document = {}
+    for field in scenario["fields"]:
+        set_path(document, field["path"], generate_value(field))
+    return document
+
+
+#
+# Running the workload
+#
+
+def scenario_worker(scenario, collection, worker, run_start, deadline, stats, results_sink):
+    fields = queryable_fields(scenario)
+    while now_ns() < deadline:
+        if random.random() < scenario["read_ratio"]:
+            field = random.choice(fields)
+            start_time = now_ns()
+            count = len(list(collection.find({ field["path"]: generate_value(field, query=True) })))
+            elapsed = stats["reads"].record_since(start_time)
+            results_sink.write((worker, READ, start_time - run_start, elapsed, count))
+        else:
+            documents = [generate_document(scenario) for i in range(scenario["batch_size"])]
+            start_time = now_ns()
+            collection.insert_many(documents)
+            elapsed = stats["writes"].record_since(start_time)
+            results_sink.write((worker, WRITE, start_time - run_start, elapsed, len(documents)))
+
+
+def run_scenario(scenario):
+    name = scenario["name"]
+    print(f"Running scenario {name} for {scenario['duration_seconds']} s "
+          f"with {scenario['concurrency']} threads...")
+
+    mongo_client = create_client()  # one pool shared by all threads
+    assert(not does_collection_exist(mongo_client, DB_NAME, scenario["collection"]))
+    create_encrypted_collection(mongo_client, scenario["collection"], encrypted_fields_map(scenario))
+    collection = mongo_client[DB_NAME].get_collection(scenario["collection"])
+
+    results_sink = ResultSink(f"scenario_{name}.bin",
+        ["worker", "operation", "start_offset_ns", "elapsed_ns", "documents"], "qqqqq")
+    all_stats = [
+        { "reads": LatencyHistogram(), "writes": LatencyHistogram() }
+        for i in range(scenario["concurrency"])
+    ]
+
+    run_start = now_ns()
+    deadline = run_start + int(scenario["duration_seconds"] * 1e9)
+    threads = [
+        threading.Thread(target=scenario_worker,
+            args=(scenario, collection, worker, run_start, deadline, stats, results_sink))
+        for worker, stats in enumerate(all_stats)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = (now_ns() - run_start) / 1e9
+    results_sink.close()
+
+    reads = LatencyHistogram()
+    writes = LatencyHistogram()
+    for stats in all_stats:
+        reads.merge(stats["reads"])
+        writes.merge(stats["writes"])
+    reads.save(f"scenario_{name}_reads.json")
+    writes.save(f"scenario_{name}_writes.json")
+
+    documents_written = writes.count * scenario["batch_size"]
+    print(f"{reads.count / elapsed:.1f} reads/s, {writes.count / elapsed:.1f} batches/s "
+          f"({documents_written / elapsed:.1f} docs/s) over {elapsed:.1f} s")
+    reads.print_summary("find")
+    writes.print_summary(f"insert_many of {scenario['batch_size']}")
+
+    read_summary = reads.summary_ms()
+    write_summary = writes.summary_ms()
+    # scenario, threads, elapsed (s), reads/s, read p50, read p99, docs/s,
+    # write p50, write p99 (ms)
+    write_line_to_csv("scenario_output.csv", [name, scenario["concurrency"], elapsed,
+        reads.count / elapsed, read_summary["p50"], read_summary["p99"],
+        documents_written / elapsed, write_summary["p50"], write_summary["p99"]])
+
+    if scenario["drop_when_done"]:
+        mongo_client[DB_NAME].drop_collection(scenario["collection"])
+    mongo_client.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python scenario.py <scenario.toml>")
+        sys.exit(1)
+    run_scenario(load_scenario(sys.argv[1]))
@@ -0,0 +1,118 @@
+"""
+How do insert and query costs grow with the size of the document and the
+number of encrypted fields in it? writer.py only inserts small documents with
+one encrypted field, which is a long way from a patient record like the ones
+in python-client/qe.py.
+
+For every combination of PAYLOAD_SIZES, QUERYABLE_FIELDS and
+UNQUERYABLE_FIELDS this creates a fresh encrypted collection, loads DOCUMENTS
+documents, runs equality finds on encrypted_string and measures how big the
+collection and its state collections got. Everything ends up in one table,
+printed and written to schema_sweep_output.csv.
+
+  * payload     - bytes of plaintext padding (a "notes" field) per document
+  * queryable   - equality-queryable encrypted fields: encrypted_string plus
+                  patientRecord.secret_1, patientRecord.secret_2, ...
+  * unqueryable - encrypted fields with no queries: patientRecord.private_1, ...
+                  each holding UNQUERYABLE_SIZE bytes
+"""
+
+import itertools
+import random
+import string
+from docgen import DocumentGenerator
+from distributions import create_distribution
+from sweeps import recreate_encrypted_collection, timed_inserts, timed_finds, total_storage, print_table, write_table_csv
+from utils import create_client, create_plain_client, DB_NAME
+
+PAYLOAD_SIZES = [0, 1024, 16384]  # bytes
+QUERYABLE_FIELDS = [1, 2, 4]
+UNQUERYABLE_FIELDS = [0, 2, 4]
+UNQUERYABLE_SIZE = 64  # bytes
+
+DOCUMENTS = 20000
+ITEMS_TO_CREATE = 200  # per insert_many
+QUERIES = 1000
+VALUE_CARDINALITY = 200
+SEED = 0
+
+COLUMNS = ["payload", "queryable", "unqueryable", "docs/s", "insert p50 ms", "insert p99 ms",
+           "find p50 ms", "find p99 ms", "MB", "state MB", "bytes/doc"]
+
+
+def encrypted_fields_map(queryable, unqueryable):
+    fields = [{ "path": "encrypted_string", "bsonType": "string", "queries": [{ "queryType": "equality" }] }]
+    for i in range(1, queryable):
+        fields.append({ "path": f"patientRecord.secret_{i}", "bsonType": "string",
+                        "queries": [{ "queryType": "equality" }] })
+    for i in range(1, unqueryable + 1):
+        fields.append({ "path": f"patientRecord.private_{i}", "bsonType": "string" })
+    return { "fields": fields }
+
+
+def random_strings(rng, size, count=100):
+    # a pool to pick from, since making big random strings is slow
+    return ["".join(rng.choices(string.ascii_letters, k=size)) for i in range(count)]
+
+
+def generate_batches(payload, queryable, unqueryable):
+    rng = random.Random(SEED)
+    notes = random_strings(rng, payload) if payload else None
+    private = random_strings(rng, UNQUERYABLE_SIZE)
+    secrets = create_distribution("uniform", VALUE_CARDINALITY)
+    generator = DocumentGenerator(seed=SEED,
+        value_distribution=create_distribution("uniform", VALUE_CARDINALITY))
+
+    for batch in generator.batches(ITEMS_TO_CREATE, DOCUMENTS):
+        for document in batch:
+            if notes:
+                document["notes"] = rng.choice(notes)
+            record = {}
+            for i in range(1, queryable):
+                record[f"secret_{i}"] = f"{secrets.next()}"
+            for i in range(1, unqueryable + 1):
+                record[f"private_{i}"] = rng.choice(private)
+            if record:
+                document["patientRecord"] = record
+        yield batch
+
+
+def run_point(mongo_client, plain_client, number, payload, queryable, unqueryable):
+    collection_name = f"schema_{number}"
+    print(f"Schema point {number}: {payload} byte payload, {queryable} queryable and "
+          f"{unqueryable} unqueryable encrypted fields...")
+    collection = recreate_encrypted_collection(mongo_client, collection_name,
+        encrypted_fields_map(queryable, unqueryable))
+
+    inserts, docs_per_second = timed_inserts(collection, generate_batches(payload, queryable, unqueryable))
+    query_values = create_distribution("uniform", VALUE_CARDINALITY)
+    finds = timed_finds(collection,
+        ({ "encrypted_string": f"{query_values.next()}" } for i in range(QUERIES)))
+
+    storage = total_storage(plain_client, collection_name)
+    mongo_client[DB_NAME].drop_collection(collection_name)
+
+    insert_summary = inserts.summary_ms()
+    find_summary = finds.summary_ms()
+    total_bytes = storage["storageSize"] + storage["totalIndexSize"] + storage["stateSize"]
+    return [payload, queryable, unqueryable, docs_per_second, insert_summary["p50"], insert_summary["p99"],
+        find_summary["p50"], find_summary["p99"], (storage["storageSize"] + storage["totalIndexSize"]) / 2**20,
+        storage["stateSize"] / 2**20, total_bytes / DOCUMENTS]
+
+
+if __name__ == "__main__":
+    mongo_client = create_client()
+    plain_client = create_plain_client()
+
+    rows = [
+        run_point(mongo_client, plain_client, number, payload, queryable, unqueryable)
+        for number, (payload, queryable, unqueryable)
+        in enumerate(itertools.product(PAYLOAD_SIZES, QUERYABLE_FIELDS, UNQUERYABLE_FIELDS))
+    ]
+
+    print()
+    print_table(COLUMNS, rows)
+    write_table_csv("schema_sweep_output.csv", COLUMNS, rows)
+
+    plain_client.close()
+    mongo_client.close()
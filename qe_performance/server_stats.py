@@ -0,0 +1,149 @@
+"""
+The server's side of a run. ServerStatsRecorder snapshots serverStatus,
+$collStats for an encrypted collection and its state collections, and
+dbStats when it's created and when it's stopped (and every interval seconds
+in between, if you like), and reports what changed:
+
+  * opcounters         - inserts, queries, getmores and commands the server saw
+  * network            - bytes in and out, and requests
+  * wiredTiger cache   - bytes in the cache, read into it and written from it
+  * collStats / dbStats - documents, data, storage and index sizes
+
+Snapshots are flattened to { "section.name": number }, so the deltas are just
+end minus start. stop() prints the deltas and saves the start, end and deltas
+to <name>_server_stats.json. Interval snapshots go to
+<name>_server_samples.csv.
+
+Use a plain client, since automatic encryption doesn't allow serverStatus or
+$collStats. Atlas needs a user with the clusterMonitor role for serverStatus;
+a local mongod is fine. A section the user isn't allowed to read is left out
+(and listed under "unavailable") rather than stopping the benchmark.
+"""
+
+import json
+import threading
+import time
+from pymongo.errors import OperationFailure
+from utils import storage_stats, state_collection_names, DB_NAME, write_line_to_csv
+
+SERVER_STATUS_FIELDS = {
+    "opcounters": ["insert", "query", "update", "delete", "getmore", "command"],
+    "network": ["bytesIn", "bytesOut", "numRequests"],
+    "connections": ["current"],
+    "mem": ["resident"],  # MB
+}
+
+WIREDTIGER_CACHE_FIELDS = [
+    "bytes currently in the cache",
+    "maximum bytes configured",
+    "tracked dirty bytes in the cache",
+    "bytes read into cache",
+    "bytes written from cache",
+    "pages read into cache",
+    "pages written from cache",
+]
+
+DB_STATS_FIELDS = ["collections", "objects", "dataSize", "storageSize", "indexes", "indexSize"]
+
+
+def server_snapshot(plain_client, collection_name, db_name=DB_NAME):
+    """
+    Returns a flat dictionary of server, collection and database statistics.
+    """
+
+    snapshot = { "time": time.time(), "unavailable": [] }
+
+    try:
+        status = plain_client.admin.command("serverStatus")
+        for section, fields in SERVER_STATUS_FIELDS.items():
+            for field in fields:
+                if field in status.get(section, {}):
+                    snapshot[f"{section}.{field}"] = status[section][field]
+        cache = status.get("wiredTiger", {}).get("cache", {})
+        for field in WIREDTIGER_CACHE_FIELDS:
+            if field in cache:
+                snapshot[f"wiredTiger.cache.{field}"] = cache[field]
+    except OperationFailure:
+        snapshot["unavailable"].append("serverStatus")
+
+    for name in [collection_name] + state_collection_names(collection_name):
+        try:
+            for stat, value in storage_stats(plain_client, name, db_name).items():
+                snapshot[f"collStats.{name}.{stat}"] = value
+        except OperationFailure:
+            snapshot["unavailable"].append(f"collStats.{name}")
+
+    try:
+        db_stats = plain_client[db_name].command("dbStats")
+        for field in DB_STATS_FIELDS:
+            if field in db_stats:
+                snapshot[f"dbStats.{field}"] = db_stats[field]
+    except OperationFailure:
+        snapshot["unavailable"].append("dbStats")
+
+    return snapshot
+
+
+def snapshot_delta(before, after):
+    return { key: after[key] - before[key] for key in after if key in before and key != "unavailable" }
+
+
+class ServerStatsRecorder:
+    """
+    Snapshots the server now, every interval seconds if interval isn't 0, and
+    when stopped.
+    """
+
+    def __init__(self, plain_client, collection_name, name, interval=0, db_name=DB_NAME):
+        self.plain_client = plain_client
+        self.collection_name = collection_name
+        self.name = name
+        self.interval = interval
+        self.db_name = db_name
+        self.start = self.snapshot()
+        if self.start["unavailable"]:
+            print(f"{name} server stats: not allowed to read {', '.join(self.start['unavailable'])}, skipping.")
+        self.columns = [column for column in self.start if column != "unavailable"]
+        self.stop_event = threading.Event()
+        self.thread = None
+        if interval:
+            write_line_to_csv(f"{name}_server_samples.csv", self.columns)
+            self._write_sample(self.start)
+            self.thread = threading.Thread(target=self._sample_loop, daemon=True)
+            self.thread.start()
+
+    def snapshot(self):
+        return server_snapshot(self.plain_client, self.collection_name, self.db_name)
+
+    def _write_sample(self, snapshot):
+        write_line_to_csv(f"{self.name}_server_samples.csv",
+            [snapshot.get(column, "") for column in self.columns])
+
+    def _sample_loop(self):
+        while not self.stop_event.wait(self.interval):
+            self._write_sample(self.snapshot())
+
+    def stop(self):
+        """
+        Takes the last snapshot, prints and saves the deltas, and returns them.
+        """
+
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        end = self.snapshot()
+        if self.interval:
+            self._write_sample(end)
+        delta = snapshot_delta(self.start, end)
+
+        print_delta(f"{self.name} server stats", delta)
+        with open(f"{self.name}_server_stats.json", "w") as file:
+            json.dump({ "start": self.start, "end": end, "delta": delta }, file, indent=2)
+        return delta
+
+
+def print_delta(name, delta):
+    print(f"{name}, change over {delta['time']:.1f} s:")
+    for key, value in delta.items():
+        if key != "time" and value:
+            print(f"  {key:>60} {value:+,}")
@@ -0,0 +1,161 @@
+"""
+A buffered place to put per-operation results.
+
+utils.write_line_to_csv opens and closes the file for every row, which is fine
+for a summary line but not for something we call after every query. A
+ResultSink keeps rows in a fixed-size ring buffer and a background thread
+packs them into a compact binary file, so the measured loop only pays for
+appending a tuple.
+
+The binary file is a magic line, a JSON header line describing the columns and
+their struct format, and then fixed-size little-endian records. Use
+export_csv (or run this module) to turn it back into a CSV:
+
+    python sink.py reader_output.bin reader_output.csv
+"""
+
+import csv
+import json
+import struct
+import sys
+import threading
+
+
+MAGIC = b"QERESULTS1\n"
+
+
+class ResultSink:
+    """
+    Rows go in with write() from any thread and come out in the file in the
+    same order. If the ring buffer fills up faster than the flusher drains it,
+    write() waits, and the wait is counted in self.stalls. If the flusher fails
+    (say a row doesn't fit the format), the next write() or close() raises.
+    """
+
+    def __init__(self, filename, columns, row_format, capacity=65536, flush_interval=1.0):
+        self.filename = filename
+        self.columns = columns
+        self.record = struct.Struct("<" + row_format)
+        if len(columns) != len(row_format):
+            raise Exception("Need exactly one struct format character per column.")
+
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.buffer = [None] * capacity
+        self.head = 0  # next row to flush
+        self.size = 0  # rows waiting to be flushed
+        self.stalls = 0
+        self.closed = False
+        self.error = None  # what stopped the flusher, if anything
+        self.condition = threading.Condition()
+
+        self.file = open(filename, "wb")
+        self.file.write(MAGIC)
+        header = { "columns": columns, "format": row_format }
+        self.file.write(json.dumps(header).encode() + b"\n")
+
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+
+    def _raise_error(self):
+        # called with the condition held
+        if self.error is not None:
+            raise Exception(f"Result sink {self.filename} failed: {self.error}") from self.error
+
+    def write(self, row):
+        with self.condition:
+            self._raise_error()
+            if self.closed:
+                raise Exception(f"Result sink {self.filename} is closed.")
+            while self.size == self.capacity:
+                self.stalls += 1
+                self.condition.notify_all()
+                self.condition.wait()
+                self._raise_error()
+            self.buffer[(self.head + self.size) % self.capacity] = row
+            self.size += 1
+            if self.size == self.capacity // 2:
+                self.condition.notify_all()  # wake the flusher early
+
+    def _take_pending(self):
+        # called with the condition held
+        rows = []
+        for _ in range(self.size):
+            rows.append(self.buffer[self.head])
+            self.buffer[self.head] = None
+            self.head = (self.head + 1) % self.capacity
+        self.size = 0
+        self.condition.notify_all()  # wake any stalled writers
+        return rows
+
+    def _flush_loop(self):
+        while True:
+            with self.condition:
+                if not self.closed and self.size < self.capacity // 2:
+                    self.condition.wait(self.flush_interval)
+                rows = self._take_pending()
+                closed = self.closed
+            if rows:
+                try:
+                    pack = self.record.pack
+                    self.file.write(b"".join(pack(*row) for row in rows))
+                except Exception as error:
+                    with self.condition:
+                        self.error = error
+                        self.condition.notify_all()  # so stalled writers see it
+                    break
+            if closed:
+                break
+        self.file.close()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.flusher.join()
+        with self.condition:
+            self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_results(filename):
+    """
+    Returns the column names and a generator over the rows of a sink file.
+    """
+
+    file = open(filename, "rb")
+    if file.readline() != MAGIC:
+        file.close()
+        raise Exception(f"{filename} is not a result sink file.")
+    header = json.loads(file.readline())
+    record = struct.Struct("<" + header["format"])
+
+    def rows():
+        with file:
+            while True:
+                data = file.read(record.size * 4096)
+                if not data:
+                    break
+                yield from record.iter_unpack(data)
+
+    return header["columns"], rows()
+
+
+def export_csv(filename, csv_filename):
+    columns, rows = read_results(filename)
+    with open(csv_filename, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python sink.py <results.bin> <results.csv>")
+        sys.exit(1)
+    export_csv(sys.argv[1], sys.argv[2])
@@ -0,0 +1,138 @@
+"""
+Splits a run into warm-up, steady state and drain, so that the first
+operations (cold connection pool, crypt_shared loading, data keys coming from
+the key vault) don't end up in the same statistics as the rest.
+
+  * warmup - at least warmup_seconds and warmup_operations, and then, if
+             wait_for_stable is set, until latency has stabilized. Measurements
+             are thrown away.
+  * steady - steady_seconds or steady_operations (whichever comes first, 0 for
+             no limit). These are the measurements to keep.
+  * drain  - drain_seconds or drain_operations more, thrown away, so that the
+             load doesn't drop off under other workers that are still in their
+             steady state.
+  * done   - stop.
+
+Latency has stabilized when the medians of the last STABLE_WINDOWS windows of
+window operations are all within tolerance (as a fraction) of each other. If
+that hasn't happened by max_warmup_seconds or max_warmup_operations (0 for no
+limit) we give up waiting and say so. max_warmup_operations also cuts
+warmup_seconds and warmup_operations short, so that a short run still gets a
+steady state.
+
+These are called stages so they don't get mixed up with the encryption phases
+in phases.py.
+"""
+
+import time
+from latency import now_ns
+
+WARMUP = "warmup"
+STEADY = "steady"
+DRAIN = "drain"
+DONE = "done"
+
+STABLE_WINDOWS = 3
+
+
+class StageTracker:
+    """
+    Call record(elapsed_ns) after each operation. It returns the stage that
+    operation belongs to, and moves on to the next stage when it's time.
+    """
+
+    def __init__(self, name, warmup_seconds=0, warmup_operations=0, wait_for_stable=False,
+                 window=100, tolerance=0.1, max_warmup_seconds=300, max_warmup_operations=0,
+                 steady_seconds=0, steady_operations=0, drain_seconds=0, drain_operations=0):
+        self.name = name
+        self.warmup_seconds = warmup_seconds
+        self.warmup_operations = warmup_operations
+        self.wait_for_stable = wait_for_stable
+        self.window = window
+        self.tolerance = tolerance
+        self.max_warmup_seconds = max_warmup_seconds
+        self.max_warmup_operations = max_warmup_operations
+        self.steady_seconds = steady_seconds
+        self.steady_operations = steady_operations
+        self.drain_seconds = drain_seconds
+        self.drain_operations = drain_operations
+
+        self.stage = WARMUP
+        self.stable = False
+        self.window_latencies = []
+        self.window_medians = []
+        self.operations = { WARMUP: 0, STEADY: 0, DRAIN: 0 }
+        self.start_times = { WARMUP: now_ns() }
+        self.wall_start_times = { WARMUP: time.time() }  # comparable across processes
+        self.wall_end_times = {}
+
+    def _stage_seconds(self, now):
+        return (now - self.start_times[self.stage]) / 1e9
+
+    def _check_stable(self, elapsed_ns):
+        self.window_latencies.append(elapsed_ns)
+        if len(self.window_latencies) < self.window:
+            return
+        self.window_medians.append(sorted(self.window_latencies)[len(self.window_latencies) // 2])
+        self.window_latencies = []
+        recent = self.window_medians[-STABLE_WINDOWS:]
+        if len(recent) == STABLE_WINDOWS and max(recent) - min(recent) <= self.tolerance * min(recent):
+            self.stable = True
+
+    def _next_stage(self, stage, now):
+        self.wall_end_times[self.stage] = time.time()
+        note = ""
+        if self.stage == WARMUP and self.wait_for_stable:
+            note = ", latency is stable" if self.stable else ", gave up waiting for latency to stabilize"
+        print(f"{self.name}: {self.stage} done after {self.operations[self.stage]} operations "
+              f"in {self._stage_seconds(now):.1f} s{note}")
+        self.stage = stage
+        self.start_times[stage] = now
+        self.wall_start_times[stage] = time.time()
+
+    def _warmup_over(self, now):
+        if self.max_warmup_operations and self.operations[WARMUP] >= self.max_warmup_operations:
+            return True
+        seconds = self._stage_seconds(now)
+        if seconds < self.warmup_seconds or self.operations[WARMUP] < self.warmup_operations:
+            return False
+        return not self.wait_for_stable or self.stable or seconds >= self.max_warmup_seconds
+
+    def _limit_reached(self, now, seconds, operations):
+        return ((seconds and self._stage_seconds(now) >= seconds) or
+                (operations and self.operations[self.stage] >= operations))
+
+    def record(self, elapsed_ns):
+        stage = self.stage
+        if stage == DONE:
+            return stage
+        self.operations[stage] += 1
+        now = now_ns()
+
+        if stage == WARMUP:
+            if self.wait_for_stable:
+                self._check_stable(elapsed_ns)
+            if self._warmup_over(now):
+                self._next_stage(STEADY, now)
+        elif stage == STEADY:
+            if self._limit_reached(now, self.steady_seconds, self.steady_operations):
+                self._next_stage(DRAIN if self.drain_seconds or self.drain_operations else DONE, now)
+        elif stage == DRAIN:
+            if self._limit_reached(now, self.drain_seconds, self.drain_operations):
+                self._next_stage(DONE, now)
+        return stage
+
+    def finish(self):
+        # for runs that end before the tracker says they're done
+        if self.stage != DONE:
+            self._next_stage(DONE, now_ns())
+
+    def steady_span(self):
+        """
+        Returns (start, end) of the steady state as time.time() values, or
+        None if the run never got there.
+        """
+
+        if STEADY not in self.wall_start_times:
+            return None
+        return self.wall_start_times[STEADY], self.wall_end_times.get(STEADY, time.time())
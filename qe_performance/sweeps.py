@@ -0,0 +1,134 @@
+"""
+Helpers shared by the sweep scripts, which all do the same thing for each
+point in the sweep: create an encrypted collection, load it, query it, see
+how big it got and add a row to a table.
+
+Every point gets its own collection name. The driver caches encryptedFields
+per namespace, so reusing a name after changing the schema can leave the
+client encrypting with the old settings.
+
+The encrypted vs. plaintext comparisons (baseline.py, resources.py and
+client_overhead.py) share encrypted_and_plaintext and generate_workload.
+"""
+
+from contextlib import contextmanager
+from docgen import DocumentGenerator
+from distributions import create_distribution
+from latency import LatencyHistogram, now_ns
+from utils import create_encrypted_collection, does_collection_exist, storage_stats, state_collection_names, DB_NAME, ENCRYPTED_FIELDS_MAP, KEY_VAULT_DATABASE, ENCRYPTED_COLLECTION, PLAINTEXT_COLLECTION, write_line_to_csv
+
+
+def recreate_encrypted_collection(mongo_client, collection_name, encrypted_fields):
+    mongo_client[DB_NAME].drop_collection(collection_name)  # takes the state collections with it
+    create_encrypted_collection(mongo_client, collection_name, encrypted_fields)
+    return mongo_client[DB_NAME].get_collection(collection_name)
+
+
+@contextmanager
+def encrypted_and_plaintext(mongo_client, plain_client, plaintext_index=True):
+    """
+    Creates ENCRYPTED_COLLECTION and its plaintext twin PLAINTEXT_COLLECTION
+    and yields (encrypted, plaintext) collections, the encrypted one through
+    mongo_client and the plaintext one through plain_client. Both databases
+    are dropped afterwards, even if the comparison fails.
+
+    The plaintext twin gets an ordinary index on encrypted_string unless
+    plaintext_index is False, since the encrypted side effectively has one in
+    __safeContent__.
+    """
+
+    assert(not does_collection_exist(mongo_client, DB_NAME, ENCRYPTED_COLLECTION))
+    assert(not does_collection_exist(mongo_client, DB_NAME, PLAINTEXT_COLLECTION))
+
+    try:
+        create_encrypted_collection(mongo_client, ENCRYPTED_COLLECTION, ENCRYPTED_FIELDS_MAP)
+        plaintext_collection = plain_client[DB_NAME].create_collection(PLAINTEXT_COLLECTION)
+        if plaintext_index:
+            plaintext_collection.create_index("encrypted_string")
+        yield mongo_client[DB_NAME].get_collection(ENCRYPTED_COLLECTION), plaintext_collection
+    finally:
+        mongo_client.drop_database(DB_NAME)
+        mongo_client.drop_database(KEY_VAULT_DATABASE)
+
+
+def generate_workload(batch_size, batch_count, queries, value_cardinality, query_distribution="uniform", seed=0):
+    """
+    Returns (batches, filters): the writer's insert_many batches and the
+    reader's encrypted_string equality filters. They're made up front, so
+    that only the inserts and finds are measured.
+    """
+
+    generator = DocumentGenerator(seed=seed,
+        value_distribution=create_distribution("uniform", value_cardinality))
+    batches = list(generator.batches(batch_size, batch_size * batch_count))
+    query_values = create_distribution(query_distribution, value_cardinality)
+    filters = [{ "encrypted_string": f"{query_values.next()}" } for i in range(queries)]
+    return batches, filters
+
+
+def timed_inserts(collection, batches, insert=None):
+    """
+    Inserts each batch and returns (latency per batch, documents per second).
+    Pass insert to do something other than insert_many with each batch.
+    """
+
+    if insert is None:
+        insert = collection.insert_many
+    histogram = LatencyHistogram()
+    documents = 0
+    overall_start_time = now_ns()
+    for batch in batches:
+        start_time = now_ns()
+        insert(batch)
+        histogram.record_since(start_time)
+        documents += len(batch)
+    elapsed = (now_ns() - overall_start_time) / 1e9
+    return histogram, documents / elapsed
+
+
+def timed_finds(collection, filters, **find_options):
+    """
+    Runs a find for each filter, reading all the results, and returns the
+    latency histogram.
+    """
+
+    histogram = LatencyHistogram()
+    for filter in filters:
+        start_time = now_ns()
+        for result in collection.find(filter, **find_options):
+            pass
+        histogram.record_since(start_time)
+    return histogram
+
+
+def total_storage(plain_client, collection_name):
+    """
+    storage_stats for an encrypted collection plus its state collections.
+    Use a plain client, since automatic encryption doesn't allow $collStats.
+    """
+
+    total = storage_stats(plain_client, collection_name)
+    total["stateCount"] = 0
+    total["stateSize"] = 0
+    for name in state_collection_names(collection_name):
+        stats = storage_stats(plain_client, name)
+        total["stateCount"] += stats["count"]
+        total["stateSize"] += stats["storageSize"] + stats["totalIndexSize"]
+    return total
+
+
+def print_table(columns, rows):
+    widths = [max([len(column)] + [len(format_cell(row[i])) for row in rows]) for i, column in enumerate(columns)]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(format_cell(cell).rjust(width) for cell, width in zip(row, widths)))
+
+
+def format_cell(cell):
+    return f"{cell:.2f}" if isinstance(cell, float) else f"{cell}"
+
+
+def write_table_csv(filename, columns, rows):
+    write_line_to_csv(filename, columns)
+    for row in rows:
+        write_line_to_csv(filename, row)
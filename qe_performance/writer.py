@@ -4,6 +4,25 @@ performance. I don't claim it to be super scientific.
 
 Author: Joel Odom
 
+Set PROCESSES above 1 to split the inserts across worker processes. Each worker
+builds its own client (so its own libmongocrypt and its own core) and writes a
+disjoint slice of the batches. The parent merges what the workers report into
+one throughput figure. If a worker fails, the parent stops the others.
+
+The first WARMUP_BATCHES batches (and then more, until insert latency settles
+down) are a warm-up and aren't counted, see stages.py. The warm-up stops
+after MAX_WARMUP_SECONDS or MAX_WARMUP_FRACTION of a worker's batches either
+way, and a worker that still never gets to a steady state reports all of its
+batches, with a warning.
+
+Set MEASURE_PHASES to split every insert_many into metadata, key vault, query
+analysis, encryption and server time (see phases.py), SAMPLE_STATE_SECONDS
+to watch the QE state collections grow (see compaction.py) and
+SAMPLE_RESOURCES_SECONDS to get CPU time per document (see resources.py).
+SERVER_STATS reports what changed on the server over the run (see
+server_stats.py). Set METRICS_PORT to watch the inserts live (see metrics.py);
+worker n serves on METRICS_PORT + n.
+
 TODO:
 
   * Upgrade to the lastest driver and shared library.
@@ -11,106 +30,299 @@ TODO:
   * Test against Atlas since this has no network latency between any parts of the system.
 """
 
-import time
-from bson import STANDARD, CodecOptions
-from pymongo.encryption import ClientEncryption
-from utils import create_client, DB_NAME, KMS_PROVIDER_CREDENTIALS, KEY_VAULT_NAMESPACE, KMS_PROVIDER_NAME, KEY_VAULT_DATABASE, ENCRYPTED_COLLECTION, write_line_to_csv
+import json
+import multiprocessing
+import threading
+from multiprocessing.connection import wait
+from sink import ResultSink
+from distributions import create_distribution
+from docgen import DocumentGenerator
+from compaction import StateSampler
+from phases import PhaseInstrumentation, PhaseRecorder
+from resources import ResourceSampler, print_totals
+from server_stats import ServerStatsRecorder
+from metrics import start_metrics_server
+from stages import StageTracker, WARMUP, STEADY, DONE
+from latency import LatencyHistogram, now_ns, NANOSECONDS_PER_MILLISECOND
+from utils import create_client, create_plain_client, create_encrypted_collection, does_collection_exist, DB_NAME, KEY_VAULT_DATABASE, ENCRYPTED_COLLECTION, ENCRYPTED_FIELDS_MAP, write_line_to_csv
 
-print("Welcome to the QE performance experiment writer.")
+ITEMS_TO_CREATE = 200
+ITERATIONS = 1000
+PROCESSES = 1  # how many client processes share the inserts
+START_TIMEOUT_SECONDS = 120  # how long workers wait for each other to be ready
+MEASURE_PHASES = False  # costs an extra explicit encryption per document
 
-mongo_client = create_client()
+# which values encrypted_string gets, see distributions.py. Sequential with a
+# cardinality of ITEMS_TO_CREATE writes each value once per batch.
+VALUE_DISTRIBUTION = "sequential"  # "uniform", "zipfian", "hotspot" or "sequential"
+VALUE_CARDINALITY = 200  # reader.py searches 0..MAX_SECRET_NUMBER
+ZIPFIAN_EXPONENT = 1.0
+HOT_FRACTION = 0.1  # for hotspot, the share of values that are hot...
+HOT_PROBABILITY = 0.9  # ...and the share of documents that get them
 
-#
-# Make sure we're starting with a clean database
-#
+SEED = 0  # worker n generates its documents from SEED + n, see docgen.py
+
+SAMPLE_STATE_SECONDS = 0  # sample the state collections this often, 0 for never
+SAMPLE_RESOURCES_SECONDS = 0  # sample each worker's CPU and memory this often, 0 for never
+SERVER_STATS = True  # snapshot serverStatus, collStats and dbStats before and after
+SERVER_STATS_SECONDS = 0  # and this often in between, 0 for never
+METRICS_PORT = 0  # e.g. 9464 to serve live OpenMetrics at /metrics
 
-def does_collection_exist(db_name, collection_name):
-    global mongo_client
-    collection_names = mongo_client[db_name].list_collection_names()
-    return collection_name in collection_names
+# warm-up, steady state and drain per worker, see stages.py
+WARMUP_SECONDS = 0
+WARMUP_BATCHES = 10
+WAIT_FOR_STABLE = True  # keep warming up until insert_many latency settles down...
+STABLE_WINDOW = 20  # ...meaning the median of the last few windows of this many batches...
+STABLE_TOLERANCE = 0.1  # ...are within 10% of each other...
+MAX_WARMUP_SECONDS = 300  # ...or until this long has passed...
+MAX_WARMUP_FRACTION = 0.2  # ...or this share of the worker's batches are done
+STEADY_SECONDS = 0  # 0 to measure all of the remaining batches
+DRAIN_SECONDS = 0  # keep inserting (unmeasured) this long after the steady state
 
-assert(not does_collection_exist(DB_NAME, ENCRYPTED_COLLECTION))
 
 #
-# Create the encrypted collection and key vault
+# Insert a bunch of random data including an encrypted string
 #
 
-ENCRYPTED_FIELDS_MAP = {  # these are the fields to encrypt automagically
-    "fields": [
-        {
-            "path": "encrypted_string",
-            "bsonType": "string",
-            "queries":
-            [ {
-                "queryType": "equality",
-            } ]  # equality queryable
-        }
+def worker_batches(worker, workers):
+    # contiguous, disjoint slices of range(ITERATIONS)
+    first = worker * ITERATIONS // workers
+    last = (worker + 1) * ITERATIONS // workers
+    return range(first, last)
+
+
+def insert_batches(worker, workers, start_barrier=None):
+    # before the client, so that its bytes are counted
+    metrics = start_metrics_server(METRICS_PORT + worker) if METRICS_PORT else None
+    mongo_client = create_client()  # each process has its own client
+    collection = mongo_client[DB_NAME].get_collection(ENCRYPTED_COLLECTION)
+    batches = worker_batches(worker, workers)
+    histogram = LatencyHistogram()
+    values = create_distribution(VALUE_DISTRIBUTION, VALUE_CARDINALITY,
+        ZIPFIAN_EXPONENT, HOT_FRACTION, HOT_PROBABILITY)
+    generator = DocumentGenerator(seed=SEED + worker, value_distribution=values)
+    if MEASURE_PHASES:
+        instrumentation = PhaseInstrumentation(DB_NAME, ENCRYPTED_COLLECTION, "encrypted_string")
+        recorder = PhaseRecorder()
+    PERF_FILE = "writer_output.bin" if workers == 1 else f"writer_output_worker{worker}.bin"
+    results_sink = ResultSink(PERF_FILE, ["iteration", "items", "elapsed_ms", "ms_per_item"], "qqdd")
+
+    if start_barrier is not None:
+        try:
+            start_barrier.wait()  # so that all of the workers start together
+        except threading.BrokenBarrierError:
+            raise Exception(f"Worker {worker} gave up waiting for the other workers to start.")
+
+    if SAMPLE_RESOURCES_SECONDS:
+        # counts every document, warm-up included, since the CPU time does too
+        resource_sampler = ResourceSampler(f"writer_resources_worker{worker}.csv", SAMPLE_RESOURCES_SECONDS)
+
+    stages = StageTracker(f"Writer worker {worker}", WARMUP_SECONDS, WARMUP_BATCHES, WAIT_FOR_STABLE,
+        STABLE_WINDOW, STABLE_TOLERANCE, max_warmup_seconds=MAX_WARMUP_SECONDS,
+        max_warmup_operations=max(1, int(len(batches) * MAX_WARMUP_FRACTION)),
+        steady_seconds=STEADY_SECONDS, drain_seconds=DRAIN_SECONDS)
+    # the warm-up's measurements, in case the steady state never comes
+    warmup_histogram = LatencyHistogram()
+    warmup_rows = []
+    if MEASURE_PHASES:
+        warmup_recorder = PhaseRecorder()
+
+    for x in batches:
+        if stages.stage == DONE:
+            break
+
+        print(f"Creating {ITEMS_TO_CREATE} random items... Iteration {x + 1} of {ITERATIONS}...")
+
+        created_items_dicts = generator.generate(ITEMS_TO_CREATE)
+
+        if metrics is not None:
+            metrics.start("insert_many")
+        if MEASURE_PHASES:
+            phases = instrumentation.measure_insert_many(created_items_dicts)
+            elapsed_ns = phases["total"]
+        else:
+            start_time = now_ns()
+            collection.insert_many(created_items_dicts)
+            elapsed_ns = now_ns() - start_time
+        if metrics is not None:
+            metrics.finish("insert_many", elapsed_ns)
+        elapsed = elapsed_ns / NANOSECONDS_PER_MILLISECOND
+
+        print(f"Items created. Elapsed time is {elapsed:.2f} ms.")
+        if SAMPLE_RESOURCES_SECONDS:
+            resource_sampler.operations.add(ITEMS_TO_CREATE)
+
+        row = (x + 1, ITEMS_TO_CREATE, elapsed, elapsed/ITEMS_TO_CREATE)
+        stage = stages.record(elapsed_ns)
+        if stage == WARMUP:
+            warmup_histogram.record(elapsed_ns)
+            warmup_rows.append(row)
+            if MEASURE_PHASES:
+                warmup_recorder.record(phases)
+        if stage != STEADY:
+            continue  # warm-up and drain don't count
+
+        histogram.record(elapsed_ns)
+        if MEASURE_PHASES:
+            recorder.record(phases)
+
+        # save the perf data (python sink.py to get a CSV)
+        results_sink.write(row)
+
+    stages.finish()
+    warmup_batches = stages.operations[WARMUP]
+    measured_batches = stages.operations[STEADY]
+    steady_span = stages.steady_span()
+    if not measured_batches:
+        print(f"Warning: worker {worker} had no batches left after its warm-up, so all {warmup_batches} of "
+              f"its batches are counted, warm-up included. Try more ITERATIONS.")
+        steady_span = (stages.wall_start_times[WARMUP], stages.wall_end_times[WARMUP])
+        histogram = warmup_histogram
+        if MEASURE_PHASES:
+            recorder = warmup_recorder
+        for row in warmup_rows:
+            results_sink.write(row)
+        measured_batches = warmup_batches
+        warmup_batches = 0
+    results_sink.close()
+    mongo_client.close()
+
+    result = {
+        "worker": worker,
+        "warmup_batches": warmup_batches,
+        "batches": measured_batches,
+        "documents": measured_batches * ITEMS_TO_CREATE,
+        "start_time": steady_span[0],  # of the steady state
+        "end_time": steady_span[1],
+        "latency": histogram.to_dict(),  # per insert_many batch
+    }
+    if MEASURE_PHASES:
+        instrumentation.close()
+        result["phases"] = recorder.to_dict()
+    if SAMPLE_RESOURCES_SECONDS:
+        result["resources"] = resource_sampler.stop()
+
+    with open(f"writer_result_worker{worker}.json", "w") as file:
+        json.dump(result, file)
+    return result
+
+
+def run_workers(workers):
+    # spawn rather than fork, since the parent already has a MongoClient open
+    context = multiprocessing.get_context("spawn")
+    start_barrier = context.Barrier(workers, timeout=START_TIMEOUT_SECONDS)
+    processes = [
+        context.Process(target=insert_batches, args=(worker, workers, start_barrier))
+        for worker in range(workers)
     ]
-}
-
-client_encryption = ClientEncryption(  # a kind of helper
-    kms_providers=KMS_PROVIDER_CREDENTIALS,
-    key_vault_namespace=KEY_VAULT_NAMESPACE,
-    key_vault_client=mongo_client,
-    codec_options=CodecOptions(uuid_representation=STANDARD)
-)
-
-CMK_CREDENTIALS = {}  # no creds because using a local key CMK
-client_encryption.create_encrypted_collection(
-    mongo_client[DB_NAME],
-    ENCRYPTED_COLLECTION,
-    ENCRYPTED_FIELDS_MAP,
-    KMS_PROVIDER_NAME,
-    CMK_CREDENTIALS,
-)
-
-assert(does_collection_exist(DB_NAME, ENCRYPTED_COLLECTION))
+    for process in processes:
+        process.start()
 
-#
-# Insert a bunch of random data including an encrypted string
-#
+    # if one worker fails, stop the rest rather than leaving them stuck at the barrier
+    running = list(processes)
+    while running:
+        for sentinel in wait([process.sentinel for process in running]):
+            process = next(process for process in running if process.sentinel == sentinel)
+            process.join()
+            running.remove(process)
+            if process.exitcode != 0:
+                for other in running:
+                    other.terminate()
+                    other.join()
+                raise Exception(f"Worker process exited with code {process.exitcode}.")
 
-ITEMS_TO_CREATE = 200
-ITERATIONS = 1000
+    # merge what the workers left behind
+    results = []
+    for worker in range(workers):
+        with open(f"writer_result_worker{worker}.json") as file:
+            results.append(json.load(file))
+    return results
 
-overall_start_time = time.time()
 
-for x in range(ITERATIONS):
-    print(f"Creating {ITEMS_TO_CREATE} random items... Iteration {x + 1} of {ITERATIONS}...")
+def report_throughput(results):
+    histogram = LatencyHistogram()
+    for result in results:
+        histogram.merge(LatencyHistogram.from_dict(result["latency"]))
+    histogram.save("writer_histogram.json")
 
-    created_items_dicts = []
+    documents = sum(result["documents"] for result in results)
+    span = max(r["end_time"] for r in results) - min(r["start_time"] for r in results)
+    docs_per_second = documents / span
 
-    for i in range(ITEMS_TO_CREATE):
-        item_name = f"Item {i}"
-        item_to_create = {
-            "name": item_name,
-            "description": f"This is item{i}.",
-            "encrypted_string": f"{i}"
-        }
-        created_items_dicts.append(item_to_create)
+    for result in results:
+        worker_span = result["end_time"] - result["start_time"]
+        print(f"  worker {result['worker']}: {result['documents']} documents in {worker_span:.1f} s "
+              f"({result['documents'] / worker_span:.1f} docs/s) after {result['warmup_batches']} warm-up batches")
+    print(f"{len(results)} process(es) inserted {documents} documents in {span:.1f} s, "
+          f"which is about {docs_per_second:.1f} docs/s or {1000 * span / documents:.3f} ms / record.")
+    histogram.print_summary(f"insert_many of {ITEMS_TO_CREATE}")
 
-    start_time = time.time()
-    mongo_client[DB_NAME].get_collection(ENCRYPTED_COLLECTION).insert_many(created_items_dicts)
-    end_time = time.time()
+    if MEASURE_PHASES:
+        recorder = PhaseRecorder()
+        for result in results:
+            recorder.merge(PhaseRecorder.from_dict(result["phases"]))
+        recorder.print_summary(f"insert_many of {ITEMS_TO_CREATE}")
+        recorder.save("writer_phases.json")
 
-    elapsed = 100*(end_time - start_time)
-    print(f"Items created. Elapsed time is {elapsed} ms.")
+    if SAMPLE_RESOURCES_SECONDS:
+        for result in results:
+            print_totals(f"  worker {result['worker']} documents", result["resources"])
+        cpu = sum(result["resources"]["cpu_user"] + result["resources"]["cpu_system"] for result in results)
+        inserted = sum(result["resources"]["operations"] for result in results)
+        print(f"CPU time per encrypted document: {1e6 * cpu / inserted:.1f} us")
 
-    PERF_FILE = "writer_output.csv"
-    # iteration number, items created, elapsed time (ms), ms per item
-    write_line_to_csv(PERF_FILE, [x + 1, ITEMS_TO_CREATE, elapsed, elapsed/ITEMS_TO_CREATE])  # save the perf data
+    # processes, documents, elapsed (s), docs/s
+    write_line_to_csv("writer_parallel_output.csv", [len(results), documents, span, docs_per_second])
 
-overall_time = 100*(time.time() - overall_start_time)
 
-print(f"It took {overall_time} ms, which is about {overall_time / ITEMS_TO_CREATE / ITERATIONS} ms / record.")
+if __name__ == "__main__":
+    print("Welcome to the QE performance experiment writer.")
 
-#
-# Clean up
-#
+    mongo_client = create_client()
+
+    #
+    # Make sure we're starting with a clean database
+    #
+
+    assert(not does_collection_exist(mongo_client, DB_NAME, ENCRYPTED_COLLECTION))
+
+    #
+    # Create the encrypted collection and key vault
+    #
+
+    create_encrypted_collection(mongo_client, ENCRYPTED_COLLECTION, ENCRYPTED_FIELDS_MAP)
+
+    assert(does_collection_exist(mongo_client, DB_NAME, ENCRYPTED_COLLECTION))
+
+    plain_client = create_plain_client()  # for stats, which automatic encryption doesn't allow
+    try:
+        if SAMPLE_STATE_SECONDS:
+            sampler = StateSampler(plain_client, ENCRYPTED_COLLECTION,
+                "writer_state_samples.csv", SAMPLE_STATE_SECONDS)
+        if SERVER_STATS:
+            server_stats = ServerStatsRecorder(plain_client, ENCRYPTED_COLLECTION, "writer", SERVER_STATS_SECONDS)
+
+        if PROCESSES == 1:
+            results = [insert_batches(0, 1)]
+        else:
+            results = run_workers(PROCESSES)
+
+        if SAMPLE_STATE_SECONDS:
+            sampler.stop()
+
+        report_throughput(results)
+        if SERVER_STATS:
+            server_stats.stop()
+    finally:
+        plain_client.close()
+
+        #
+        # Clean up, even after a failed run, so that the next one starts clean
+        #
 
-mongo_client.drop_database(DB_NAME)
-mongo_client.drop_database(KEY_VAULT_DATABASE)
+        mongo_client.drop_database(DB_NAME)
+        mongo_client.drop_database(KEY_VAULT_DATABASE)
 
-assert(not does_collection_exist(DB_NAME, ENCRYPTED_COLLECTION))
+        assert(not does_collection_exist(mongo_client, DB_NAME, ENCRYPTED_COLLECTION))
 
-mongo_client.close()
+        mongo_client.close()